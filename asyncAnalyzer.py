@@ -0,0 +1,202 @@
+# asyncAnalyzer: asyncio front-end for streaming drum beat analysis
+#                (Python 3)
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+Usage:
+
+    async for event in analyzeStream(blocks, bpm=90, sens=8, backpressure="drop"):
+        print(event["result"])
+
+analyzeStream is an async generator that takes an async iterable of PCM
+blocks (int16 arrays or raw bytes, any length) and yields a beat event
+as soon as audioProcessing finds peaks. The samples are collected into
+blocks of block_size and analyzed in an executor (the event loop's
+default thread pool unless one is given), so the event loop is never
+blocked. One block is analyzed at a time, in order.
+
+Blocks read while the analysis is busy wait in a queue of max_pending
+blocks. What happens when it is full is set by backpressure:
+
+    "block"     the input is not read until there is room again, which
+                pushes back on the sender (e.g. the WebSocket)
+    "drop"      the new block is dropped and counted, like a full
+                spscRingBuffer
+    "coalesce"  the input is never waited on; the oldest pending block
+                is dropped instead, and all pending blocks are analyzed
+                in one executor call with only the beat event after the
+                last of them yielded
+
+Dropped blocks are skipped over by audioProcessing.skipBlocks, so the
+peaks after them keep their timing.
+
+A beat event is a dict with the block number, the peak anchor, beat_loc,
+beat_error and the C/E/L result. If a stats dict is passed it is kept up
+to date with the number of blocks read, dropped and analyzed.
+
+wavBlocks reads a wav file as an async iterable, paced like a live
+device, to stand in for a network stream when testing:
+
+    python3 asyncAnalyzer.py drum_beat_recording.wav --backpressure drop
+
+"""
+
+import sys
+import asyncio
+import argparse
+import numpy
+from audioProcessing import audioProcessing
+from utility import getBeatResult
+from utility import wavReader
+
+# -------------------------------------------------
+# global parameters
+# -------------------------------------------------
+sampling_rate = 44100
+block_size    = 4096
+sample_size   = 2     # bytes per sample (int16)
+
+# -------------------------------------------------
+# analyze a stream of PCM blocks
+# -------------------------------------------------
+async def analyzeStream(blocks, bpm, sens, level=2, backpressure="block", max_pending=8,
+                        executor=None, stats=None):
+    if backpressure not in ("block", "drop", "coalesce"):
+        raise ValueError("Unknown backpressure: " + str(backpressure))
+    if stats is None:
+        stats = {}
+    stats.update(num_read=0, num_dropped=0, num_analyzed=0)
+
+    loop = asyncio.get_running_loop()
+    ap = audioProcessing(bpm, (10-sens+1)/100.0)
+    queue = asyncio.Queue(max_pending)
+    reader = asyncio.ensure_future(readBlocks(blocks, queue, backpressure, stats))
+
+    try:
+        while True:
+            batch = [await queue.get()]
+            if backpressure == "coalesce":
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+
+            # end of stream, or the reader failed
+            end_of_stream = batch[-1] is None
+            if end_of_stream:
+                batch.pop()
+
+            if len(batch) > 0:
+                peak_found = await loop.run_in_executor(executor, processBlocks, ap, batch)
+                stats["num_analyzed"] = stats["num_analyzed"] + len(batch)
+                if peak_found:
+                    beat_loc   = list(ap.getBeatLoc())
+                    beat_error = [float(e) for e in ap.getBeatError()]
+                    yield {"block":      batch[-1][0],
+                           "anchor":     ap.peak_loc_anchor,
+                           "beat_loc":   beat_loc,
+                           "beat_error": beat_error,
+                           "result":     getBeatResult(beat_loc, beat_error, level)}
+
+            if end_of_stream:
+                break
+
+        # re-raises an error from the input
+        await reader
+    finally:
+        reader.cancel()
+
+# -------------------------------------------------
+# analyze blocks (executor thread)
+# -------------------------------------------------
+def processBlocks(ap, batch):
+    # batch holds (block number, samples), ap has been given (analyzed
+    # or skipped) ap.iter blocks so far
+    peak_found = False
+    for n, s in batch:
+        if n > ap.iter and ap.skipBlocks(n - ap.iter) > 0:
+            peak_found = True
+        if ap.audioSampleProcessing(s) > 0:
+            peak_found = True
+    return peak_found
+
+# -------------------------------------------------
+# read the input into blocks of block_size
+# -------------------------------------------------
+async def readBlocks(blocks, queue, backpressure, stats):
+    pending = bytearray()
+    num_bytes = block_size*sample_size
+    try:
+        async for s in blocks:
+            if isinstance(s, numpy.ndarray):
+                s = s.astype(numpy.int16, copy=False).tobytes()
+            pending.extend(s)
+
+            while len(pending) >= num_bytes:
+                block = (stats["num_read"], numpy.frombuffer(bytes(pending[:num_bytes]), dtype=numpy.int16))
+                del pending[:num_bytes]
+                stats["num_read"] = stats["num_read"] + 1
+                if queue.full() and backpressure == "drop":
+                    stats["num_dropped"] = stats["num_dropped"] + 1
+                elif queue.full() and backpressure == "coalesce":
+                    queue.get_nowait()
+                    stats["num_dropped"] = stats["num_dropped"] + 1
+                    await queue.put(block)
+                else:
+                    await queue.put(block)
+
+                # neither a source that never waits nor a put into a
+                # queue with room suspends, let the analysis run
+                await asyncio.sleep(0)
+    except Exception:
+        # wake up the analysis, which raises the error
+        await queue.put(None)
+        raise
+
+    # end of stream, samples short of a whole block are discarded
+    await queue.put(None)
+
+# -------------------------------------------------
+# wav file as an async stream of blocks
+# -------------------------------------------------
+async def wavBlocks(file_name, frames_per_block=1024, realtime=True):
+    wr = wavReader(file_name)
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    num_samples = 0
+    try:
+        for s in wr.getBlocks(frames_per_block):
+            yield numpy.array(s, dtype=numpy.int16)
+            num_samples = num_samples + len(s)
+            if realtime:
+                await asyncio.sleep(max(0, start_time + num_samples/sampling_rate - loop.time()))
+    finally:
+        wr.close()
+
+# -------------------------------------------------
+# main function
+# -------------------------------------------------
+async def run(args):
+    stats = {}
+    blocks = wavBlocks(args.file, realtime=not args.fast)
+    async for event in analyzeStream(blocks, args.bpm, args.sens, args.level,
+                                     args.backpressure, args.max_pending, stats=stats):
+        print("%6d: %s" % (event["block"], event["result"]))
+    sys.stderr.write("%d blocks, %d dropped\n" % (stats["num_read"], stats["num_dropped"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a wav file through the asyncio analyzer.")
+    parser.add_argument("file", help="wav file (mono, 16 bit, 44.1 kHz)")
+    parser.add_argument("--bpm", type=int, default=90)
+    parser.add_argument("--sens", type=int, default=8, help="sensitivity, 0 to 10")
+    parser.add_argument("--level", type=int, default=2, help="1=expert, 2=normal, 3=easy")
+    parser.add_argument("--backpressure", choices=["block", "drop", "coalesce"], default="block")
+    parser.add_argument("--max-pending", type=int, default=8, help="blocks waiting for analysis")
+    parser.add_argument("--fast", action="store_true",
+                        help="read the file as fast as possible instead of in real time")
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
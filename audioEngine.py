@@ -0,0 +1,94 @@
+# audioEngine: full-duplex audio engine running in PortAudio callback
+#              mode, plays the metronome and queues captured blocks
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+The audioEngine class opens one full-duplex PyAudio stream in
+non-blocking (callback) mode. The callback, which runs on PortAudio's
+audio thread, only hands out the next pre-rendered metronome block and
+appends the captured block to a queue. A collections.deque is used as
+the queue: append and popleft are atomic, so neither side ever waits on
+a lock for it. The Python side takes blocks out with read(), which
+sleeps on an event the callback sets, independently of the device
+clock.
+
+"""
+
+import threading
+import collections
+import pyaudio
+
+class audioEngine:
+    def __init__(self, metro, sampling_rate, block_size):
+        # passed in parameters
+        self.metro = metro
+        self.sampling_rate = sampling_rate
+        self.block_size = block_size
+        self.pyaudio_format = pyaudio.paInt16
+
+        # captured blocks (raw bytes from PortAudio)
+        self.in_queue = collections.deque()
+        self.data_ready = threading.Event()
+
+        # number of callbacks reporting an input/output under/overflow
+        self.num_xruns = 0
+
+        self.p = None
+        self.stream = None
+
+    # -------------------------------------------
+    # audio callback (PortAudio thread)
+    # -------------------------------------------
+    def callback(self, in_data, frame_count, time_info, status_flags):
+        if status_flags != 0:
+            self.num_xruns = self.num_xruns + 1
+        self.in_queue.append(in_data)
+        self.data_ready.set()
+
+        # metronome blocks are int16 views, passed through their buffer
+        return (self.metro.get_samples(), pyaudio.paContinue)
+
+    # -------------------------------------------
+    # start the stream
+    # -------------------------------------------
+    def start(self):
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format = self.pyaudio_format,
+                                  channels = 1,
+                                  rate = self.sampling_rate,
+                                  input = True,
+                                  output = True,
+                                  frames_per_buffer = self.block_size,
+                                  stream_callback = self.callback)
+
+    # -------------------------------------------
+    # read a captured block
+    # -------------------------------------------
+    def read(self, timeout):
+        # wait (up to timeout seconds) for a captured block,
+        # returns None on timeout
+        if len(self.in_queue) == 0:
+            self.data_ready.clear()
+            # check again, the callback may have appended before clear
+            if len(self.in_queue) == 0:
+                self.data_ready.wait(timeout)
+            if len(self.in_queue) == 0:
+                return None
+        return self.in_queue.popleft()
+
+    # -------------------------------------------
+    # get sample size (in bytes)
+    # -------------------------------------------
+    def getSampleSize(self):
+        return pyaudio.get_sample_size(self.pyaudio_format)
+
+    # -------------------------------------------
+    # stop the stream
+    # -------------------------------------------
+    def stop(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+        self.stream = None
+        self.p = None
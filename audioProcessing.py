@@ -7,10 +7,67 @@ import math
 import numpy
 from utility import getHammingWindow
 from utility import getLowPassFilter
+from utility import getLowBandDFTMatrix
+from utility import ringBuffer
+from utility import firFilter
+from utility import timeMethod
+from utility import coefficientCache
+
+# -------------------------------------------------
+# precomputed tables for one set of parameters
+# -------------------------------------------------
+class processingPlan:
+    """
+    Window, filter taps and DFT tables for one parameter set. Plans are
+    kept in plan_cache (a bounded coefficientCache) and shared by all
+    audioProcessing instances with the same parameters, so the arrays
+    are read-only.
+    """
+    def __init__(self, env_mode, block_size, N_fft, N_step, N_env_bin, Fs, fc, N_tap):
+        T = block_size//N_step
+        
+        # window for FFT
+        self.w_sm = getHammingWindow(N_fft)
+        
+        # low band DFT matrix
+        self.w_dft = None
+        if env_mode == 'dft':
+            self.w_dft = getLowBandDFTMatrix(self.w_sm, N_env_bin)
+        
+        # sliding DFT tables
+        self.e_sdft  = None
+        self.r_sdft  = None
+        self.tw_sdft = None
+        if env_mode == 'sdft':
+            N_seg = N_fft//N_step # hops per frame
+            k = numpy.arange(N_env_bin+1)
+            
+            # DFT of one hop segment (bins 0 to N_env_bin, unwindowed)
+            self.e_sdft = numpy.exp(-2j*numpy.pi*numpy.outer(numpy.arange(N_step), k)/N_fft)
+            
+            # per-hop rotation r^n = exp(j*2*pi*k*n*N_step/N_fft), n = 0..T
+            self.r_sdft = numpy.exp(2j*numpy.pi*numpy.outer(numpy.arange(T+1), k)*N_step/N_fft)
+            
+            # segment twiddles for a direct (resync) frame sum
+            self.tw_sdft = numpy.exp(-2j*numpy.pi*numpy.outer(numpy.arange(N_seg), k)*N_step/N_fft)
+        
+        # low pass filter tap coefficient
+        self.h_lp = getLowPassFilter(fc, Fs/N_step, N_tap)
+        
+        for a in self.__dict__.values():
+            if a is not None:
+                a.flags.writeable = False
+
+# plans by (env_mode, block_size, N_fft, N_step, N_env_bin, Fs, fc, N_tap)
+plan_cache = coefficientCache(processingPlan)
+
+def getProcessingPlan(*params):
+    return plan_cache.get(*params)
 
 class audioProcessing:
     # -------------------------------------------
     # class variables shared by all instances
+    # (block_size, N_fft and N_step are defaults)
     # -------------------------------------------
     # low pass filter
     fc          = 5;  # in Hz
@@ -21,42 +78,83 @@ class audioProcessing:
     block_size  = 4096
     N_fft       = 2048
     N_step      = 256
+    N_env_bin   = 50 # number of low freq bins summed into the envelope
+    N_resync    = 4  # sliding DFT resync interval in blocks
+    N_chunk     = 256 # frames per batch in whole signal analysis
+    N_batch     = 32  # frames per FFT call in multi-instance processing
     
     # peak picking params
     t2          = 0  # this is dynamic threshould, computed based on neighboring samples
     lambda_peak = 0.4
     t_size      = 40
-    t_inp_size  = block_size/N_step
+    t_inp_size  = block_size//N_step
+    
+    # peak location correction in envelope samples, 7*t_inp_size
+    # (112) unless set, e.g. to a measured one (latencyCalibration)
+    latency_offset = None
 
     # -------------------------------------------
     # initialization
     # -------------------------------------------
-    def __init__(self, bpm, t1):
+    def __init__(self, bpm, t1, env_mode='fft', block_size=None, N_fft=None, N_step=None):
     
         # reset number of iteration
         self.iter = 0
         
-        # get window for FFT
-        self.w_sm = getHammingWindow(self.N_fft)
-    
-        # get low pass filter tap coefficient
-        self.h_lp = getLowPassFilter(self.fc, self.Fs/self.N_step, self.N_tap)
+        # block, FFT and hop sizes, the class defaults unless given
+        if block_size is not None:
+            self.block_size = block_size
+        if N_fft is not None:
+            self.N_fft = N_fft
+        if N_step is not None:
+            self.N_step = N_step
+        if self.block_size % self.N_step != 0:
+            raise ValueError("block_size must be a multiple of N_step")
+        if self.N_fft < self.N_step or 2*self.N_env_bin > self.N_fft:
+            raise ValueError("N_fft too small")
+        self.t_inp_size = self.block_size//self.N_step
+        if self.latency_offset is None:
+            self.latency_offset = 7*self.t_inp_size
+        
+        # blocks of delay until the frames starting in a block are
+        # complete (2 for the defaults)
+        self.N_delay = 1 - (-(self.N_fft - self.N_step)//self.block_size)
+        
+        # envelope backend:
+        #   'fft'  - batched real FFT over the full spectrum
+        #   'dft'  - windowed DFT of the low freq bins only
+        #   'sdft' - sliding DFT of the low freq bins, updated per hop
+        if env_mode not in ('fft', 'dft', 'sdft'):
+            raise ValueError("Unknown envelope mode: " + str(env_mode))
+        if env_mode == 'sdft' and self.N_fft % self.N_step != 0:
+            raise ValueError("N_fft must be a multiple of N_step for 'sdft'")
+        self.env_mode = env_mode
+        
+        # window, filter and DFT tables, shared with other instances
+        plan = getProcessingPlan(env_mode, self.block_size, self.N_fft, self.N_step,
+                                 self.N_env_bin, self.Fs, self.fc, self.N_tap)
+        self.w_sm    = plan.w_sm
+        self.w_dft   = plan.w_dft
+        self.e_sdft  = plan.e_sdft
+        self.r_sdft  = plan.r_sdft
+        self.tw_sdft = plan.tw_sdft
+        self.h_lp    = plan.h_lp
+        if env_mode == 'sdft':
+            self.initSlidingDFT()
         
         # compute beat duration (4-th note)
         self.beat_duration = 60.0/bpm/4*self.Fs/self.N_step;
         
-        # initialize sample buffers
-        self.s_in_buffer = []
-        for n in range(4*self.block_size):
-            self.s_in_buffer.append(0)    
+        # initialize sample buffers, frames start 2 blocks in
+        self.s_in_buffer  = ringBuffer((self.N_delay+2)*self.block_size)
+        # envelope history must reach t_size+1 samples before the
+        # oldest peak candidate for the dynamic threshold
+        env_buffer_size   = max(5*self.t_inp_size, 2*self.t_inp_size + self.t_size + 1)
+        self.s_env_buffer = ringBuffer(env_buffer_size)
+        self.s_csum_buffer = ringBuffer(env_buffer_size) # running sum of s_env
             
-        self.s_env_buffer = []
-        for n in range(5*self.t_inp_size):
-            self.s_env_buffer.append(0)
-            
-        self.h_lp_state = []
-        for n in range(self.N_tap):
-            self.h_lp_state.append(0)
+        # last N_tap-1 filter inputs, oldest first
+        self.h_lp_state = numpy.zeros(self.N_tap-1)
 
         # initialize beat_loc and beat_error (2 bars of 16th note)
         self.beat_loc     = []
@@ -76,33 +174,62 @@ class audioProcessing:
     # -------------------------------------------
     def audioSampleProcessing(self, s):
             
+        # fill s_in_buffer, wait until buffer is full
+        if not self.addSamples(s):
+            return 0
+
+        # STFT
+        s_env = self.getShortTimeFFT()
+        
+        return self.processEnvelope(s_env)
+
+    # -------------------------------------------
+    # skip dropped blocks
+    # -------------------------------------------
+    def skipBlocks(self, n):
+        """
+        Keeps the sample clock over n dropped blocks, the same as feeding
+        n blocks of zeros. Once the buffers hold only zeros, more of them
+        change nothing but the block count, so at most enough zero blocks
+        to flush the buffers are processed. Returns the number of peaks
+        found (before the gap).
+        """
+        n_flush = self.N_delay + 3 + -(-self.s_env_buffer.length//self.t_inp_size)
+        s = numpy.zeros(self.block_size, dtype=numpy.int16)
+        peak_found = 0
+        for k in range(min(n, n_flush)):
+            peak_found = peak_found + self.audioSampleProcessing(s)
+        self.iter = self.iter + max(0, n - n_flush)
+        return peak_found
+
+    # -------------------------------------------
+    # add a block of input samples
+    # -------------------------------------------
+    def addSamples(self, s):
+        
         # increment iteration count
         self.iter = self.iter + 1
         
         # fill s_in_buffer
-        for n in range(3*self.block_size):
-            self.s_in_buffer[n] = self.s_in_buffer[self.block_size+n]
-        for n in range(self.block_size):
-            self.s_in_buffer[3*self.block_size+n] = s[n]/32768.0
+        self.s_in_buffer.write(s, 1/32768.0)
         
-        # wait until buffer is full
-        if self.iter < 4:
-            return 0
-
-        # STFT
-        s_env = self.getShortTimeFFT()
+        # True once the buffer is full
+        return self.iter >= self.N_delay + 2
+        
+    # -------------------------------------------
+    # envelope processing and peak picking
+    # -------------------------------------------
+    def processEnvelope(self, s_env):
         
         # low pass filtering
         s_env_lp = self.getLowPassFiltering(s_env)
         
-        # fill in s_env_buffer
-        for n in range(4*self.t_inp_size):
-            self.s_env_buffer[n] = self.s_env_buffer[self.t_inp_size+n]
-        for n in range(self.t_inp_size):
-            self.s_env_buffer[4*self.t_inp_size+n] = s_env_lp[n]
+        # fill in s_env_buffer and its running sum
+        self.s_env_buffer.write(s_env_lp)
+        self.s_csum_buffer.write(self.s_csum_buffer.getWindow()[-1] + numpy.cumsum(s_env_lp))
         
         # wait until buffer is full 
-        if self.iter < 5:
+        if self.iter < self.N_delay + 3:
             return 0
         
         # peak picking
@@ -115,25 +242,104 @@ class audioProcessing:
     # -------------------------------------------
     def getShortTimeFFT(self):
         
-        s_env = []
-        for n in range(self.block_size/self.N_step):
-            # apply window
-            s_win = []
-            for m in range(self.N_fft):
-                temp_s = self.s_in_buffer[2*self.block_size + m + n*self.N_step]
-                s_win.append( temp_s * self.w_sm[m] )
-            # FFT
-            s_fft = abs(numpy.fft.fft(s_win))
-            
-            # get low freq components
-            # summation of FFT bins from 0 to 49, 
-            # this corresponds to 0 to 1076 Hz with
-            # sampling rate of 44.1k and 2048-point FFT 
-            temp_accum = 0
-            for m in range(50):
-                temp_accum = temp_accum + s_fft[m]
-            
-            s_env.append(temp_accum / self.N_fft)
+        if self.env_mode == 'sdft':
+            return self.getSlidingDFT()
+        
+        return self.getFrameEnvelope(self.getFrames())
+        
+    # -------------------------------------------
+    # frames of the current block
+    # -------------------------------------------
+    def getFrames(self):
+        
+        # all hop positions as one strided 2-D view (no copy),
+        # row n starts at 2*block_size + n*N_step
+        s_in = self.s_in_buffer.getWindow()[2*self.block_size:]
+        s_frames = numpy.lib.stride_tricks.as_strided(
+            s_in,
+            shape=(self.t_inp_size, self.N_fft),
+            strides=(self.N_step*s_in.strides[0], s_in.strides[0]))
+        
+        return s_frames
+        
+    # -------------------------------------------
+    # envelope of a batch of frames
+    # -------------------------------------------
+    def getFrameEnvelope(self, s_frames, is_windowed=False):
+        
+        if self.env_mode == 'dft':
+            # windowed DFT of bins 0 to N_env_bin-1 only, cos and
+            # sin parts come out side by side from one matrix product
+            s_dft = numpy.dot(s_frames, self.w_dft)
+            s_mag = numpy.hypot(s_dft[:, :self.N_env_bin], s_dft[:, self.N_env_bin:])
+        else:
+            # apply window (unless done by the caller) and batched real FFT
+            if not is_windowed:
+                s_frames = s_frames * self.w_sm
+            s_fft = numpy.fft.rfft(s_frames, axis=1)
+            s_mag = numpy.abs(s_fft[:, :self.N_env_bin])
+        
+        # get low freq components
+        # summation of FFT bins from 0 to 49, 
+        # this corresponds to 0 to 1076 Hz with
+        # sampling rate of 44.1k and 2048-point FFT 
+        s_env = s_mag.sum(axis=1) / self.N_fft
+        
+        return s_env
+        
+    # -------------------------------------------
+    # sliding DFT initialization
+    # -------------------------------------------
+    def initSlidingDFT(self):
+        
+        # the tables are in the plan (e_sdft, r_sdft, tw_sdft)
+        # state: segment DFTs of the last frame and its bins
+        self.sdft_seg = None
+        self.sdft_bin = None
+        self.sdft_cnt = 0
+        
+    # -------------------------------------------
+    # sliding DFT envelope
+    # -------------------------------------------
+    def getSlidingDFT(self):
+        
+        # the frame at hop n covers segments n..n+N_seg-1, counted in
+        # N_step units from 2*block_size, stored segments are -1..N_seg-2
+        N_seg  = self.N_fft//self.N_step
+        T      = self.t_inp_size
+        s_in   = self.s_in_buffer.getWindow()[2*self.block_size-self.N_step:]
+        s_segs = numpy.lib.stride_tricks.as_strided(
+            s_in,
+            shape=(N_seg+T, self.N_step),
+            strides=(self.N_step*s_in.strides[0], s_in.strides[0]))
+        
+        # DFT of the new segments only
+        seg_new = numpy.dot(s_segs[N_seg:], self.e_sdft)
+        
+        # (re)start from a direct sum of the stored segments, this bounds
+        # the rounding error accumulated by the recursion
+        if self.sdft_seg is None:
+            self.sdft_seg = numpy.dot(s_segs[:N_seg], self.e_sdft)
+            self.sdft_cnt = 0
+        if self.sdft_cnt % self.N_resync == 0:
+            self.sdft_bin = (self.tw_sdft * self.sdft_seg).sum(axis=0)
+        self.sdft_cnt = self.sdft_cnt + 1
+        seg = numpy.vstack((self.sdft_seg, seg_new))
+        
+        # X(n) = r*(X(n-1) - oldest segment + newest segment), unrolled
+        # over the block: X(n) = r^(n+1)*(X(-1) + sum_m<=n r^-m * d(m))
+        d = seg[N_seg:] - seg[:T]
+        X = self.r_sdft[1:] * (self.sdft_bin + numpy.cumsum(self.r_sdft[:T].conj() * d, axis=0))
+        
+        self.sdft_seg = seg[T:]
+        self.sdft_bin = X[-1]
+        
+        # Hamming window in frequency domain:
+        # Xw(k) = 0.54*X(k) - 0.23*(X(k-1) + X(k+1)), X(-1) = conj(X(1))
+        X_lo = numpy.hstack((X[:, 1:2].conj(), X[:, :self.N_env_bin-1]))
+        X_w  = 0.54*X[:, :self.N_env_bin] - 0.23*(X_lo + X[:, 1:])
+        
+        s_env = numpy.abs(X_w).sum(axis=1) / self.N_fft
         
         return s_env
         
@@ -142,18 +348,8 @@ class audioProcessing:
     # -------------------------------------------
     def getLowPassFiltering(self, s_env):
     
-        s_env_lp = []
-        for n in range(self.block_size/self.N_step):
-            # update filter state
-            for m in range(1,self.N_tap):
-                self.h_lp_state[self.N_tap-m] = self.h_lp_state[self.N_tap-m-1]
-            self.h_lp_state[0] = s_env[n]
-            
-            # filtering
-            temp_accum = 0
-            for m in range(self.N_tap):
-                temp_accum = temp_accum + self.h_lp[m] * self.h_lp_state[m]
-            s_env_lp.append(temp_accum)
+        # filter the whole block, carrying the state to the next one
+        s_env_lp, self.h_lp_state = firFilter(self.h_lp, s_env, self.h_lp_state)
         
         return s_env_lp
     
@@ -162,36 +358,116 @@ class audioProcessing:
     # -------------------------------------------
     def getPeak(self):
     
+        s_env  = self.s_env_buffer.getWindow()
+        s_csum = self.s_csum_buffer.getWindow()
+        
+        # inspection window: the second newest block of envelope samples
+        T   = self.t_inp_size
+        n_0 = len(s_env) - 2*T
+        s_c = s_env[n_0:n_0+T]
+        
+        # dynamic threshold (t2), the mean of the t_size samples
+        # before each candidate from the running sum
+        t2 = (s_csum[n_0-1:n_0+T-1] - s_csum[n_0-self.t_size-1:n_0+T-self.t_size-1])/self.t_size
+        
+        # samples above t1, local peaks and above t1 + t2*lambda_peak
+        is_peak = ((s_c >= self.t1) &
+                   (s_c >= s_env[n_0-1:n_0+T-1]) &
+                   (s_c >= s_env[n_0+1:n_0+T+1]) &
+                   (s_c >= self.t1 + t2*self.lambda_peak))
+        
         peak_found = 0
-        for n in range(3*self.t_inp_size, 4*self.t_inp_size):
-            # skip if sample is less than t1
-            if (self.s_env_buffer[n] < self.t1):
-                continue
-            
-            # skip if sample is not a peak
-            if (self.s_env_buffer[n] < self.s_env_buffer[n-1] or
-                self.s_env_buffer[n] < self.s_env_buffer[n+1]):
-                continue
-            
-            # dynamic threshold checking (t2)
-            temp_accum = 0
-            for m in range(self.t_size):
-                temp_accum = temp_accum + self.s_env_buffer[n-self.t_size+m]
-            t2 = temp_accum/self.t_size
-            
-            if self.s_env_buffer[n] < self.t1 + t2*self.lambda_peak:
-                continue
-            
+        for n in numpy.flatnonzero(is_peak):
             # peak found!
-            peak_loc = n + self.iter*self.t_inp_size - 112
-            self.num_peaks = self.num_peaks + 1
+            peak_loc = int(n) + (self.iter + 5 - self.N_delay)*T - self.latency_offset
             peak_found = peak_found + 1
-                    
-            # compute beat info
-            self.computeBeatInfo(peak_loc)
+            self.addPeak(peak_loc)
         
         return peak_found    
     
+    # -------------------------------------------
+    # whole signal analysis
+    # -------------------------------------------
+    def analyzeSignal(self, s):
+        """
+        Analyze a complete recording (int16 samples) in one pass. The
+        peaks and beat info are the same as feeding s block by block to
+        audioSampleProcessing (last block zero padded); the 'sdft' mode
+        uses the FFT envelope here. Beat info is reset first, the
+        streaming buffers are not touched. Returns the peak locations.
+        """
+        self.num_peaks       = 0
+        self.peak_loc_anchor = 0
+        self.beat_loc_offset = 0
+        self.clearBeatInfo()
+        
+        peak_locs = self.getSignalPeaks(s)
+        for peak_loc in peak_locs:
+            self.addPeak(peak_loc)
+        
+        return peak_locs
+    
+    # -------------------------------------------
+    # peak locations of a whole signal
+    # -------------------------------------------
+    def getSignalPeaks(self, s):
+    
+        # envelope sample e is the frame starting at e*N_step, the
+        # streaming path computes e = 2*T.. from block N_delay+2 on
+        # and inspects e = 2*T..(num_blocks-N_delay)*T-1 for peaks
+        T          = self.t_inp_size
+        num_blocks = -(-len(s)//self.block_size)
+        if num_blocks < self.N_delay + 3:
+            return []
+        e_0 = 2*T
+        e_1 = (num_blocks-self.N_delay+1)*T
+        
+        # STFT, in chunks of frames to bound memory, the input (which
+        # may be a memory-mapped file) is only read chunk by chunk
+        s_env = numpy.zeros(e_1)
+        for n in range(e_0, e_1, self.N_chunk):
+            n_end = min(n+self.N_chunk, e_1)
+            s_src = s[n*self.N_step:(n_end-1)*self.N_step+self.N_fft]
+            
+            # zero padded beyond the end of the signal
+            s_in = numpy.zeros((n_end-n-1)*self.N_step + self.N_fft)
+            numpy.multiply(s_src, 1/32768.0, out=s_in[:len(s_src)])
+            s_frames = numpy.lib.stride_tricks.as_strided(
+                s_in,
+                shape=(n_end-n, self.N_fft),
+                strides=(self.N_step*s_in.strides[0], s_in.strides[0]))
+            s_env[n:n_end] = self.getFrameEnvelope(s_frames)
+        
+        # low pass filtering
+        s_env[e_0:], h_lp_end = firFilter(self.h_lp, s_env[e_0:], numpy.zeros(self.N_tap-1))
+        
+        # running sum, accumulated per block as in the streaming path,
+        # with t_size+1 leading zeros
+        s_csum = numpy.cumsum(s_env[e_0:].reshape(-1, T), axis=1)
+        s_csum += numpy.concatenate(([0], numpy.cumsum(s_csum[:-1, -1])))[:, numpy.newaxis]
+        s_csum = numpy.concatenate((numpy.zeros(self.t_size+1+e_0), s_csum.ravel()))
+        
+        # peak picking over all candidates
+        e   = numpy.arange(e_0, (num_blocks-self.N_delay)*T)
+        s_c = s_env[e]
+        t2  = (s_csum[e+self.t_size] - s_csum[e])/self.t_size
+        is_peak = ((s_c >= self.t1) &
+                   (s_c >= s_env[e-1]) &
+                   (s_c >= s_env[e+1]) &
+                   (s_c >= self.t1 + t2*self.lambda_peak))
+        
+        # same latency correction as getPeak
+        return [int(n) + 6*T - self.latency_offset for n in e[is_peak]]
+    
+    # -------------------------------------------
+    # add a detected peak
+    # -------------------------------------------
+    def addPeak(self, peak_loc):
+        self.num_peaks = self.num_peaks + 1
+            
+        # compute beat info
+        self.computeBeatInfo(peak_loc)
+    
     # -------------------------------------------
     # compute beat info
     # -------------------------------------------
@@ -237,6 +513,62 @@ class audioProcessing:
     def getBeatError(self):
         return self.beat_error
     
-    
+    # -------------------------------------------
+    # enable (or disable) stage timers
+    # -------------------------------------------
+    def setPerfCounters(self, perf):
+        # the stages of this instance are replaced by timed versions,
+        # perf=None restores them, the processing itself has no checks
+        for name in ('audioSampleProcessing', 'getShortTimeFFT', 'getLowPassFiltering', 'getPeak'):
+            self.__dict__.pop(name, None)
+            if perf is not None:
+                timeMethod(self, name, perf)
 
-    
\ No newline at end of file
+# -------------------------------------------------
+# audio sample processing for many instances
+# -------------------------------------------------
+def audioSampleProcessingBatch(aps, blocks):
+    """
+    Same as aps[k].audioSampleProcessing(blocks[k]) for every k, returns
+    the list of peak_found. The frames of all instances with the same
+    envelope backend and frame size are gathered into one array and
+    their envelopes computed together, N_batch frames per FFT call, then
+    passed back to each instance for filtering and peak picking. 'sdft'
+    mode instances keep their own sliding DFT state and run one by one.
+    """
+    peak_found = [0]*len(aps)
+    
+    # fill the input buffers, group the instances that are ready
+    groups = {}
+    for k in range(len(aps)):
+        ap = aps[k]
+        if not ap.addSamples(blocks[k]):
+            continue
+        if ap.env_mode == 'sdft':
+            peak_found[k] = ap.processEnvelope(ap.getSlidingDFT())
+            continue
+        groups.setdefault((ap.env_mode, ap.t_inp_size, ap.N_fft), []).append(k)
+    
+    for group in groups.values():
+        ap = aps[group[0]]
+        T  = ap.t_inp_size
+        
+        # gather the frames, the FFT window is applied on the way
+        is_windowed = ap.env_mode == 'fft'
+        s_frames = numpy.empty((len(group)*T, ap.N_fft))
+        for n in range(len(group)):
+            if is_windowed:
+                numpy.multiply(aps[group[n]].getFrames(), ap.w_sm, out=s_frames[n*T:(n+1)*T])
+            else:
+                s_frames[n*T:(n+1)*T] = aps[group[n]].getFrames()
+        
+        # batched envelope
+        s_env = numpy.empty(len(group)*T)
+        for n in range(0, len(s_frames), ap.N_batch):
+            s_env[n:n+ap.N_batch] = ap.getFrameEnvelope(s_frames[n:n+ap.N_batch], is_windowed)
+        
+        # scatter to the instances
+        for n in range(len(group)):
+            peak_found[group[n]] = aps[group[n]].processEnvelope(s_env[n*T:(n+1)*T])
+    
+    return peak_found
@@ -0,0 +1,217 @@
+# batchAnalyzer: headless drum beat analyzer, scores a directory of
+#                wav recordings in parallel and writes the results
+#                as json or csv
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+Usage:
+
+    python batchAnalyzer.py recordings/ --bpm 90 --sens 8 --level 2 \\
+                            --format csv --output results.csv
+
+Each wav file (mono, 16 bit) is memory-mapped and analyzed in one pass with
+audioProcessing.getSignalPeaks, which gives the same peaks as streaming
+it block by block through audioSampleProcessing (use --stream for the
+streaming path, exactly as the GUI does with live audio). The results of
+every 2-bar page (beat_loc, beat_error and the C/E/L timing result) are
+collected per file. Files are spread over a process pool, one file per
+task.
+
+--block-size, --fft-size and --hop change the analysis block, FFT frame
+and hop sizes (in samples) from the audioProcessing defaults; a smaller
+block gives peaks sooner when streaming.
+
+"""
+
+import os
+import sys
+import time
+import json
+import csv
+import argparse
+import multiprocessing
+import numpy
+from audioProcessing import audioProcessing
+from utility import getBeatResult
+from utility import wavReader
+
+# -------------------------------------------------
+# global parameters
+# -------------------------------------------------
+sampling_rate = 44100
+block_size    = 4096
+
+# -------------------------------------------------
+# find wav files
+# -------------------------------------------------
+def findWavFiles(paths):
+    wav_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if name.lower().endswith(".wav"):
+                        wav_files.append(os.path.join(root, name))
+        else:
+            wav_files.append(path)
+    return sorted(wav_files)
+
+# -------------------------------------------------
+# open wav file and check its format
+# -------------------------------------------------
+def openWavFile(file_name):
+    wr = wavReader(file_name)
+    if wr.num_channels != 1:
+        raise ValueError("Expected mono audio")
+    if wr.sampling_rate != sampling_rate:
+        raise ValueError("Expected sampling rate of " + str(sampling_rate))
+    return wr
+
+# -------------------------------------------------
+# read wav file block by block
+# -------------------------------------------------
+def readWavBlocks(file_name, block_size=block_size):
+    wr = openWavFile(file_name)
+    for s in wr.getBlocks(block_size):
+        num_samples = len(s)
+        # zero pad the last block
+        if num_samples < block_size:
+            s = numpy.concatenate((s, numpy.zeros(block_size-num_samples, dtype='<i2')))
+        yield s, num_samples
+    wr.close()
+
+# -------------------------------------------------
+# analyze one file
+# -------------------------------------------------
+def analyzeFile(task):
+    file_name, bpm, sens, level, stream, sizes = task
+
+    result = {"file": file_name, "bpm": bpm}
+    try:
+        ap = audioProcessing(bpm, (10-sens+1)/100.0, **sizes)
+        pages = []
+
+        if stream:
+            # page snapshot after every block with a peak
+            duration = 0
+            for s, num_samples in readWavBlocks(file_name, ap.block_size):
+                duration = duration + num_samples
+                if ap.audioSampleProcessing(s) > 0:
+                    addPage(pages, ap, level)
+        else:
+            # page snapshot after every peak
+            wr = openWavFile(file_name)
+            for peak_loc in ap.getSignalPeaks(wr.samples):
+                ap.addPeak(peak_loc)
+                addPage(pages, ap, level)
+            duration = wr.num_frames
+            wr.close()
+
+        result["duration"]  = duration/float(sampling_rate)
+        result["num_peaks"] = ap.num_peaks
+        result["pages"]     = pages
+    except Exception as e:
+        # reported with the file, the other files go on
+        result["error"] = e.__class__.__name__ + ": " + str(e)
+
+    return result
+
+# -------------------------------------------------
+# update the pages with the current beat info
+# -------------------------------------------------
+def addPage(pages, ap, level):
+    page = {"anchor":     ap.peak_loc_anchor,
+            "beat_loc":   list(ap.getBeatLoc()),
+            "beat_error": [float(e) for e in ap.getBeatError()]}
+    page["result"] = getBeatResult(page["beat_loc"], page["beat_error"], level)
+
+    # a new page starts when the peak anchor moves
+    if len(pages) > 0 and pages[-1]["anchor"] == page["anchor"]:
+        pages[-1] = page
+    else:
+        pages.append(page)
+
+# -------------------------------------------------
+# write results
+# -------------------------------------------------
+def writeJson(results, f):
+    json.dump(results, f, indent=2)
+    f.write("\n")
+
+def writeCsv(results, f):
+    writer = csv.writer(f)
+    writer.writerow(["file", "bpm", "page", "num_peaks", "result", "beat_loc", "beat_error", "error"])
+    for r in results:
+        if "error" in r:
+            writer.writerow([r["file"], r["bpm"], "", "", "", "", "", r["error"]])
+            continue
+        if len(r["pages"]) == 0:
+            # analyzed, but no peaks (silence or below t1)
+            writer.writerow([r["file"], r["bpm"], "", r["num_peaks"], "", "", "", ""])
+            continue
+        for n, page in enumerate(r["pages"]):
+            writer.writerow([r["file"], r["bpm"], n, r["num_peaks"], page["result"],
+                             " ".join(str(b) for b in page["beat_loc"]),
+                             " ".join("%.4f" % e for e in page["beat_error"]),
+                             ""])
+
+# -------------------------------------------------
+# main function
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score drum beat recordings offline.")
+    parser.add_argument("paths", nargs="+", help="wav files or directories")
+    parser.add_argument("--bpm", type=int, default=90)
+    parser.add_argument("--sens", type=int, default=8, help="sensitivity, 0 to 10")
+    parser.add_argument("--level", type=int, default=2, help="1=expert, 2=normal, 3=easy")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the files block by block like live audio")
+    parser.add_argument("--block-size", type=int, help="analysis block size in samples")
+    parser.add_argument("--fft-size", type=int, help="FFT frame size in samples")
+    parser.add_argument("--hop", type=int, help="hop size in samples, divides the block size")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    sizes = {"block_size": args.block_size, "N_fft": args.fft_size, "N_step": args.hop}
+    try:
+        audioProcessing(args.bpm, 0.1, **sizes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    wav_files = findWavFiles(args.paths)
+    tasks = [(file_name, args.bpm, args.sens, args.level, args.stream, sizes) for file_name in wav_files]
+
+    # one file per task keeps all workers busy until the end
+    start_time = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        results = []
+        for r in pool.imap_unordered(analyzeFile, tasks):
+            results.append(r)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start_time
+    results.sort(key=lambda r: r["file"])
+
+    if args.output:
+        f = open(args.output, "wb" if args.format == "csv" else "w")
+    else:
+        f = sys.stdout
+    if args.format == "csv":
+        writeCsv(results, f)
+    else:
+        writeJson(results, f)
+    if f is not sys.stdout:
+        f.close()
+
+    sys.stderr.write("%d files in %.2f s (%.2f files/s, %d workers)\n" %
+                     (len(results), elapsed, len(results)/max(elapsed, 1e-9), args.jobs))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# benchmark: timing of the audio processing stages and the metronome,
+#            with the results saved as json for comparing runs
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+Usage:
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json --compare before.json
+
+A synthetic drum recording (decaying 120 Hz hits with timing jitter on
+a noise floor) and drum_beat_recording.wav, or the wav files given, are
+fed block by block through audioProcessing. audioSampleProcessing is
+timed per block first. The signal is then fed again to time each stage
+on its own: getShortTimeFFT, getLowPassFiltering and getPeak. The first
+blocks, before the buffers are full, are not counted.
+metronome.get_samples is timed at the analysis and audio device block
+sizes.
+
+For each stage the per-call time percentiles (p50, p99, max, in ms),
+calls per second and the real-time factor (mean time over the block
+duration, must stay well below 1) are reported, with the number of
+calls over the block duration, each of which would be an xrun when
+running live.
+
+"""
+
+import os
+import sys
+import time
+import json
+import platform
+import argparse
+import numpy
+from audioProcessing import audioProcessing
+from metronome import metronome
+from utility import perfCounters
+from utility import timeMethod
+from utility import wavReader
+
+# -------------------------------------------------
+# global parameters
+# -------------------------------------------------
+sampling_rate    = 44100
+block_size       = 4096
+audio_block_size = 512
+
+# -------------------------------------------------
+# synthetic drum recording
+# -------------------------------------------------
+def getSyntheticSignal(bpm, seconds, seed=1):
+    rng = numpy.random.RandomState(seed)
+    n = int(seconds*sampling_rate)
+    s = rng.randn(n)*300
+
+    # 8th note hits with 20 ms jitter
+    hit_len = 3000
+    hit = 20000*numpy.exp(-numpy.arange(hit_len)/400.0)*numpy.sin(2*numpy.pi*120*numpy.arange(hit_len)/sampling_rate)
+    hit_times = numpy.arange(0.5, seconds-0.5, 60.0/bpm/2)
+    for t in hit_times + rng.randn(len(hit_times))*0.02:
+        m = int(t*sampling_rate)
+        s[m:m+hit_len] += hit[:len(s[m:m+hit_len])]
+
+    return numpy.clip(s, -32768, 32767).astype(numpy.int16)
+
+# -------------------------------------------------
+# timing statistics
+# -------------------------------------------------
+def getTimingStats(times, period):
+    # times and period in seconds
+    t = numpy.array(times)
+    if len(t) == 0:
+        return {"num_calls": 0}
+    mean = t.mean()
+    return {"num_calls":         len(t),
+            "p50_ms":            float(numpy.percentile(t, 50))*1e3,
+            "p99_ms":            float(numpy.percentile(t, 99))*1e3,
+            "max_ms":            float(t.max())*1e3,
+            "mean_ms":           float(mean)*1e3,
+            "calls_per_s":       float(1/mean) if mean > 0 else None,
+            "real_time_factor":  float(mean/period),
+            "num_over_deadline": int((t > period).sum())}
+
+# -------------------------------------------------
+# audio processing benchmark
+# -------------------------------------------------
+def benchmarkProcessing(s, bpm, t1, env_mode, repeat):
+    period = block_size/float(sampling_rate)
+    num_blocks = len(s)//block_size
+    blocks = [s[n*block_size:(n+1)*block_size] for n in range(num_blocks)]
+
+    # whole block, without the stage timers
+    times = []
+    for r in range(repeat):
+        ap = audioProcessing(bpm, t1, env_mode)
+        for blk in blocks:
+            t0 = perfCounters.timer()
+            ap.audioSampleProcessing(blk)
+            t = perfCounters.timer() - t0
+            if ap.iter >= 5:
+                times.append(t)
+    results = {"audioSampleProcessing": getTimingStats(times, period)}
+
+    # each stage
+    stages = ["getShortTimeFFT", "getLowPassFiltering", "getPeak"]
+    perf = perfCounters(keep_times=True)
+    for r in range(repeat):
+        ap = audioProcessing(bpm, t1, env_mode)
+        for name in stages:
+            timeMethod(ap, name, perf)
+        for blk in blocks:
+            ap.audioSampleProcessing(blk)
+    for name in stages:
+        results[name] = getTimingStats(perf.getTimes(name), period)
+
+    return results
+
+# -------------------------------------------------
+# metronome benchmark
+# -------------------------------------------------
+def benchmarkMetronome(bpm, seconds):
+    results = {}
+    for bs in (block_size, audio_block_size):
+        metro = metronome(bpm, sampling_rate, bs)
+        times = []
+        for n in range(int(seconds*sampling_rate)//bs):
+            t0 = perfCounters.timer()
+            metro.get_samples()
+            times.append(perfCounters.timer() - t0)
+        results["get_samples_%d" % bs] = getTimingStats(times, bs/float(sampling_rate))
+    return results
+
+# -------------------------------------------------
+# print results, compared with an earlier run
+# -------------------------------------------------
+def printResults(results, baseline=None):
+    out = sys.stdout
+    out.write("%-24s %-22s %9s %9s %9s %8s %5s\n" %
+              ("signal", "stage", "p50 ms", "p99 ms", "max ms", "rtf", "late"))
+    for signal_name in sorted(results["signals"]):
+        for stage, r in sorted(results["signals"][signal_name].items()):
+            if r["num_calls"] == 0:
+                continue
+            out.write("%-24s %-22s %9.3f %9.3f %9.3f %8.4f %5d\n" %
+                      (signal_name[-24:], stage, r["p50_ms"], r["p99_ms"], r["max_ms"],
+                       r["real_time_factor"], r["num_over_deadline"]))
+            try:
+                b = baseline["signals"][signal_name][stage]
+                out.write("%-24s %-22s %8.2fx %8.2fx %8.2fx\n" %
+                          ("", "  vs baseline", r["p50_ms"]/b["p50_ms"], r["p99_ms"]/b["p99_ms"],
+                           r["max_ms"]/b["max_ms"]))
+            except (TypeError, KeyError, ZeroDivisionError):
+                pass
+
+# -------------------------------------------------
+# main function
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the audio processing stages.")
+    parser.add_argument("wav_files", nargs="*", help="wav files (default: drum_beat_recording.wav)")
+    parser.add_argument("--bpm", type=int, default=90)
+    parser.add_argument("--sens", type=int, default=8, help="sensitivity, 0 to 10")
+    parser.add_argument("--env-mode", choices=["fft", "dft", "sdft"], default="fft")
+    parser.add_argument("--seconds", type=float, default=60, help="length of the synthetic signal")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over each signal")
+    parser.add_argument("-o", "--output", help="save the results as json")
+    parser.add_argument("--compare", help="json results of an earlier run")
+    args = parser.parse_args(argv)
+
+    t1 = (10-args.sens+1)/100.0
+    signals = [("synthetic", getSyntheticSignal(args.bpm, args.seconds))]
+    wav_files = args.wav_files
+    if len(wav_files) == 0 and os.path.exists("drum_beat_recording.wav"):
+        wav_files = ["drum_beat_recording.wav"]
+    for file_name in wav_files:
+        signals.append((file_name, wavReader(file_name).samples))
+
+    results = {"python":        platform.python_version(),
+               "numpy":         numpy.__version__,
+               "machine":       platform.machine(),
+               "time":          time.strftime("%Y-%m-%d %H:%M:%S"),
+               "sampling_rate": sampling_rate,
+               "block_size":    block_size,
+               "env_mode":      args.env_mode,
+               "signals":       {}}
+    for signal_name, s in signals:
+        results["signals"][signal_name] = benchmarkProcessing(s, args.bpm, t1, args.env_mode, args.repeat)
+    results["signals"]["metronome"] = benchmarkMetronome(args.bpm, args.seconds)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    printResults(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,127 +5,161 @@
 # Copyright (c) 2015 Bing Hwa Cheng
 
 import math
-import pyaudio
 import wave
 import numpy
-import struct
 import thread
 from Tkinter import *
 from metronome import *
 from audioProcessing import *
+from audioEngine import audioEngine
 from utility import playWavFile
 from utility import printScore
 from utility import getDefaultScore
-from utility import saveWavFile
+from utility import wavWriter
+from utility import spscRingBuffer
+from utility import perfCounters
+from dspWorker import dspWorker
+from latencyCalibration import loadLatencyOffset
 
 # -------------------------------------------------
 # global variables
 # -------------------------------------------------
 # constants
-sampling_rate = 44100
-block_size    = 4096
+sampling_rate    = 44100
+block_size       = 4096 # analysis block size
+audio_block_size = 512  # audio device block size, divides block_size
+max_rec_time     = 1800 # max recording length in seconds
+use_dsp_process  = 0    # 1: run audio processing in a worker process
+use_perf_counters = 0   # 1: collect timing counters, logged every perf_log_interval
+perf_log_interval = 5   # in seconds
 
 # shared between functions/threads
 is_audio_play_active = 0
 is_capture_active    = 0
-raw_sample_buffer    = []
-rd_ptr               = 0
-wr_ptr               = 0
+raw_sample_buffer    = None
 score_text           = ""
 result_text          = ""
+perf                 = None # perfCounters, if enabled
+score_time           = None # time the block with the last peak was taken
+perf_log_time        = 0
 
 # -------------------------------------------------
 # beat tracking start
 # -------------------------------------------------
 def startAudio(bpm):
 
-    global is_capture_active, raw_sample_buffer, rd_ptr, wr_ptr, score_text, is_audio_play_active
+    global is_capture_active, raw_sample_buffer, score_text, is_audio_play_active
         
     # system parameters
     total_num_beats = 15 # capture length in number of 4th note
-    pyaudio_format = pyaudio.paInt16
     
-    # initialize pyaudio
-    p = pyaudio.PyAudio()
-    stream = p.open(format = pyaudio_format, 
-                    channels = 1, 
-                    rate = sampling_rate, 
-                    input = True,
-                    output = True, 
-                    frames_per_buffer=block_size)
-
-    # initialize metronome
-    metro = metronome(bpm, sampling_rate, block_size)
+    # initialize metronome and audio engine (callback mode)
+    metro = metronome(bpm, sampling_rate, audio_block_size)
+    engine = audioEngine(metro, sampling_rate, audio_block_size)
     
-    # start playing and recording
-    frames = []
-    rec_wav = numpy.array([])
+    # start playing and recording, the recording is written
+    # to the wav file as it is captured
+    rec_wav = wavWriter(max_samples=max_rec_time*sampling_rate)
+    rec_wav.open("drum_beat_recording.wav",
+                 engine.getSampleSize(),
+                 sampling_rate)
+    engine.start()
     is_capture_active = 1
     
-    #for n in range(sampling_rate*total_num_beats*60/bpm/block_size):
     while is_audio_play_active:
     
-        # write metronome samples to audio output
-        temp=metro.get_samples()
-        data_out = ''.join(struct.pack('h', samp) for samp in temp)
-        stream.write(data_out, block_size)
-     
-        # read audio input
-        data = stream.read(block_size)
+        # read audio input queued by the audio callback
+        data = engine.read(0.1)
+        if data is None:
+            continue
+        if perf is not None:
+            t0 = perf.timer()
         
-        # skip the beginning
-        #if n<sampling_rate*3.5*60/bpm/block_size:
-        #    continue
+        temp_data = numpy.frombuffer(data, dtype=numpy.int16)
+        rec_wav.append_block(temp_data)
         
-        temp_data = numpy.fromstring(data, 'Int16');
-        rec_wav = numpy.concatenate([rec_wav, temp_data]);
-        frames.append(data)
+        # pass to audio processing, which takes blocks of block_size
+        raw_sample_buffer.write(temp_data)
         
-        for m in range(block_size):
-            raw_sample_buffer[m + wr_ptr*block_size] = temp_data[m]
-        wr_ptr = (wr_ptr + 1)%128
+        if perf is not None:
+            perf.addTime("capture", perf.timer() - t0)
+            perf.setValue("ring_fill", raw_sample_buffer.getFillLevel())
+            perf.setValue("audio_xruns", engine.num_xruns)
+            perf.setValue("ring_overruns", raw_sample_buffer.num_overruns)
     
     # ends capture
     is_capture_active = 0
         
-    # terminate pyaudio
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-
-    # save recording in wav file
-    saveWavFile(p.get_sample_size(pyaudio_format),
-                sampling_rate,
-                rec_wav)
+    # terminate audio engine
+    engine.stop()
+    if engine.num_xruns > 0:
+        print str(engine.num_xruns) + " audio xruns"
+    if raw_sample_buffer.num_overruns > 0:
+        print str(raw_sample_buffer.num_overruns) + " blocks dropped by audio processing"
+
+    # finish the wav file
+    if rec_wav.num_dropped > 0:
+        print "recording limit reached, " + str(rec_wav.num_dropped) + " samples not saved"
+    rec_wav.close()
+    
+    if perf is not None:
+        print perf.getLogLine()
         
 # -------------------------------------------------
 # start audio processing thread
 # -------------------------------------------------
 def audioProcThread(ap):
-    global is_capture_active, raw_sample_buffer, rd_ptr, wr_ptr, score_text, result_text
+    global is_capture_active, raw_sample_buffer, score_text, result_text, score_time
 
     num_peak_detected = 0
     while is_capture_active == 1:
-        if rd_ptr != wr_ptr:
-            temp_data = []
-            for n in range(block_size):
-                temp_data.append(raw_sample_buffer[n + rd_ptr*block_size])
-            peak_found = ap.audioSampleProcessing(temp_data)
-            rd_ptr = (rd_ptr + 1)%128
-        
-            # peak detected, update score_text
-            if peak_found > 0:
-                beat_loc   = ap.getBeatLoc()
-                beat_error = ap.getBeatError()
-                score_text, result_text = printScore(beat_loc, beat_error, var_level.get())
+        # wait for the next block, the timeout lets the loop
+        # see the end of capture
+        temp_data = raw_sample_buffer.getBlock(0.1)
+        if temp_data is None:
+            continue
+        if perf is not None:
+            block_time = perf.timer()
+        peak_found = ap.audioSampleProcessing(temp_data)
+        raw_sample_buffer.releaseBlock()
+    
+        # peak detected, update score_text
+        if peak_found > 0:
+            beat_loc   = ap.getBeatLoc()
+            beat_error = ap.getBeatError()
+            score_text, result_text = printScore(beat_loc, beat_error, var_level.get())
+            if perf is not None:
+                perf.count("peaks", peak_found)
+                score_time = block_time
             
     print "audio processing thread terminated"
     
+# -------------------------------------------------
+# receive results from the audio processing process
+# -------------------------------------------------
+def dspResultThread(dsp):
+    global is_audio_play_active, is_capture_active, score_text, result_text, score_time
+
+    while is_audio_play_active == 1 or is_capture_active == 1:
+        result = dsp.getResult(0.1)
+        if result is None:
+            continue
+        
+        # peak detected, update score_text
+        beat_loc, beat_error = result
+        score_text, result_text = printScore(beat_loc, beat_error, var_level.get())
+        if perf is not None:
+            perf.count("results")
+            score_time = perf.timer()
+    
+    dsp.stop()
+    print "audio processing process terminated"
+    
 # -------------------------------------------------
 # GUI handler function for start beat tracking
 # -------------------------------------------------
 def startAudioGUI():
-    global is_audio_play_active, score_text, result_text, raw_sample_buffer, rd_ptr, wr_ptr
+    global is_audio_play_active, score_text, result_text, raw_sample_buffer, perf
     print "start audio playing/recording!!!" ;
     print "sens = " + str(var_sens.get())+ ", bpm = " + str(var_bpm.get())
     
@@ -136,12 +170,24 @@ def startAudioGUI():
         is_audio_play_active = 1
     
     
-    # initialize raw_sample_buffer and rd/wr ptrs
-    raw_sample_buffer = []
-    for n in range(128*block_size):
-        raw_sample_buffer.append(0)
-    rd_ptr = 0
-    wr_ptr = 0
+    # performance counters
+    if use_perf_counters == 1:
+        perf = perfCounters()
+    
+    # measured latency offset (latencyCalibration), if any
+    latency_offset = loadLatencyOffset(block_size, audioProcessing.N_step)
+    if latency_offset is not None:
+        print "latency_offset = " + str(latency_offset)
+    
+    # initialize raw_sample_buffer (128 blocks), in shared memory
+    # if audio processing runs in a worker process
+    t1 = (10-var_sens.get()+1)/100.0
+    if use_dsp_process == 1:
+        dsp = dspWorker(var_bpm.get(), t1, block_size, latency_offset=latency_offset)
+        raw_sample_buffer = dsp.ring
+        dsp.start()
+    else:
+        raw_sample_buffer = spscRingBuffer(128, block_size)
     
     # clear text field
     score_text, result_text = getDefaultScore()
@@ -153,8 +199,14 @@ def startAudioGUI():
     thread.start_new_thread(startAudio, (var_bpm.get(),) )
 
     # initialize audio proc and start audio processing thread
-    ap = audioProcessing(var_bpm.get(), (10-var_sens.get()+1)/100.0)
-    thread.start_new_thread(audioProcThread, (ap,))
+    if use_dsp_process == 1:
+        thread.start_new_thread(dspResultThread, (dsp,))
+    else:
+        ap = audioProcessing(var_bpm.get(), t1, block_size=block_size)
+        if latency_offset is not None:
+            ap.latency_offset = latency_offset
+        ap.setPerfCounters(perf)
+        thread.start_new_thread(audioProcThread, (ap,))
     
 # -------------------------------------------------
 # GUI handler function for stop audio
@@ -165,13 +217,23 @@ def stopAudioGUI():
     is_audio_play_active = 0
 
 def pull_score_text():
-    global score_text, result_text
+    global score_text, result_text, score_time, perf_log_time
     var_1.set(score_text)
     label_1.update_idletasks()
     
     var_2.set(result_text)
     label_2.update_idletasks()
     
+    # time from the block with the peak to its display,
+    # and the periodic log line
+    if perf is not None:
+        if score_time is not None:
+            perf.addTime("peak_to_display", perf.timer() - score_time)
+            score_time = None
+        if is_audio_play_active == 1 and perf.timer() - perf_log_time >= perf_log_interval:
+            perf_log_time = perf.timer()
+            print perf.getLogLine()
+    
     label_1.after(100, pull_score_text)
     
 
@@ -0,0 +1,87 @@
+# dspWorker: runs audioProcessing in a separate process, fed through
+#            a shared-memory sample ring
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+The dspWorker class moves beat analysis out of the GUI/audio process so
+that it does not compete for the same GIL. Audio blocks are written to
+a shared-memory spscRingBuffer (write never waits, a full ring drops
+the block and counts an overrun). The worker process reads whole blocks
+from the ring, runs audioProcessing.audioSampleProcessing on them and,
+whenever peaks are found, sends a (beat_loc, beat_error) snapshot back
+through a multiprocessing queue.
+
+"""
+
+import Queue
+import multiprocessing
+from audioProcessing import audioProcessing
+from utility import spscRingBuffer
+
+# -------------------------------------------------
+# worker process main loop
+# -------------------------------------------------
+def runDspWorker(ring, result_queue, stop_event, bpm, t1, env_mode, latency_offset):
+    ap = audioProcessing(bpm, t1, env_mode, block_size=ring.block_size)
+    if latency_offset is not None:
+        ap.latency_offset = latency_offset
+
+    # results not yet read when stopping are dropped, this
+    # keeps the process from blocking on exit
+    result_queue.cancel_join_thread()
+
+    while not stop_event.is_set():
+        s = ring.getBlock(0.1)
+        if s is None:
+            continue
+        peak_found = ap.audioSampleProcessing(s)
+        ring.releaseBlock()
+
+        if peak_found > 0:
+            result_queue.put((list(ap.getBeatLoc()), [float(e) for e in ap.getBeatError()]))
+
+class dspWorker:
+    def __init__(self, bpm, t1, block_size, num_blocks=128, env_mode='fft', latency_offset=None):
+        self.ring = spscRingBuffer(num_blocks, block_size, shared=True)
+        self.result_queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=runDspWorker,
+                                               args=(self.ring, self.result_queue, self.stop_event,
+                                                     bpm, t1, env_mode, latency_offset))
+        self.process.daemon = True
+
+    # -------------------------------------------
+    # start the worker process
+    # -------------------------------------------
+    def start(self):
+        self.process.start()
+
+    # -------------------------------------------
+    # pass audio samples (int16) to the worker
+    # -------------------------------------------
+    def write(self, s):
+        return self.ring.write(s)
+
+    # -------------------------------------------
+    # get the latest beat info
+    # -------------------------------------------
+    def getResult(self, timeout):
+        # waits up to timeout seconds for a result, older results still
+        # in the queue are skipped, returns None on timeout
+        try:
+            result = self.result_queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+        while True:
+            try:
+                result = self.result_queue.get_nowait()
+            except Queue.Empty:
+                return result
+
+    # -------------------------------------------
+    # stop the worker process
+    # -------------------------------------------
+    def stop(self):
+        self.stop_event.set()
+        self.process.join()
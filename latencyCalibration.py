@@ -0,0 +1,231 @@
+# latencyCalibration: measures the latency from metronome click to its
+#                     detection by audioProcessing over a loopback
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+Usage:
+
+    python latencyCalibration.py                   # audio device loopback
+    python latencyCalibration.py --file rec.wav    # recorded loopback
+    python latencyCalibration.py --simulate 30     # virtual loopback, 30 ms
+
+The metronome clicks are played and recorded at the same time, with the
+output fed back to the input: a loopback cable, or the speaker picked up
+by the microphone. Since capture and playback start together (one
+full-duplex stream), click k is played at sample k*pulse_interval of the
+recording. The recording is analyzed by audioProcessing, and every peak
+is matched to the nearest click. The difference (peak_loc*N_step minus
+the click position) is made of two parts:
+- the analysis bias, measured the same way on a virtual loopback with no
+  delay;
+- the system round trip.
+The median and spread (jitter) of the round trip are reported.
+
+The measured offset is the latency_offset (in envelope samples) that
+puts the detected peaks on the clicks. It is saved in
+latency_calibration.json, and drumBeatAnalyzer uses it in place of the
+default, as long as the block size and hop size still match. Beat
+errors are measured between peaks, so they do not depend on this
+offset, but peak locations then line up with the metronome output.
+
+A recording made by drumBeatAnalyzer (drum_beat_recording.wav) can be
+used with --file if the clicks were picked up. --simulate delays the
+rendered clicks by the given latency (and random jitter), with noise
+added, to test the mode without hardware.
+
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy
+import metronome as metronome_module
+from metronome import metronome
+from audioProcessing import audioProcessing
+from utility import wavReader
+
+# -------------------------------------------------
+# global parameters
+# -------------------------------------------------
+sampling_rate    = 44100
+audio_block_size = 512
+calibration_file = "latency_calibration.json"
+
+# -------------------------------------------------
+# positions of the audible clicks
+# -------------------------------------------------
+def getClickPositions(metro, num_samples):
+    # click k starts at k*pulse_interval and plays beat k-1,
+    # the count-in has silent clicks
+    clicks = []
+    k = 1
+    while k*metro.pulse_interval < num_samples:
+        beat_cnt = k - 1
+        if beat_cnt < 8:
+            amp = metronome_module.amp_arr_start[beat_cnt%8]
+        else:
+            amp = metronome_module.amp_arr[beat_cnt%8]
+        if amp > 0:
+            clicks.append(k*metro.pulse_interval)
+        k = k + 1
+    return numpy.array(clicks)
+
+# -------------------------------------------------
+# loopback recordings
+# -------------------------------------------------
+def simulateLoopback(bpm, seconds, latency_ms, jitter_ms=0.0, noise=300.0, seed=1):
+    # each click delayed by latency_ms plus gaussian jitter
+    rng = numpy.random.RandomState(seed)
+    metro = metronome(bpm, sampling_rate, audio_block_size)
+    num_samples = int(seconds*sampling_rate)
+    s_out = metro.render_samples(0, num_samples).astype(numpy.float64)
+
+    s = rng.randn(num_samples)*noise
+    clicks = getClickPositions(metro, num_samples)
+    for n in range(len(clicks)):
+        n_0 = clicks[n]
+        n_1 = clicks[n+1] if n+1 < len(clicks) else num_samples
+        delay = int(round((latency_ms + rng.randn()*jitter_ms)*sampling_rate/1000.0))
+        m = max(0, min(n_0 + delay, num_samples))
+        seg = s_out[n_0:n_1][:num_samples-m]
+        s[m:m+len(seg)] += seg
+    return numpy.clip(s, -32768, 32767).astype(numpy.int16)
+
+def recordLoopback(bpm, seconds):
+    # plays the metronome and records at the same time
+    from audioEngine import audioEngine
+
+    metro = metronome(bpm, sampling_rate, audio_block_size)
+    engine = audioEngine(metro, sampling_rate, audio_block_size)
+    num_samples = int(seconds*sampling_rate)
+    blocks = []
+    engine.start()
+    try:
+        while len(blocks)*audio_block_size < num_samples:
+            data = engine.read(1.0)
+            if data is None:
+                raise IOError("No audio input")
+            blocks.append(numpy.frombuffer(data, dtype=numpy.int16))
+    finally:
+        engine.stop()
+    if engine.num_xruns > 0:
+        sys.stderr.write("warning: %d audio xruns during calibration\n" % engine.num_xruns)
+    return numpy.concatenate(blocks)
+
+# -------------------------------------------------
+# click to peak delays (in samples)
+# -------------------------------------------------
+def getClickDelays(s, bpm, t1, block_size=None):
+    metro = metronome(bpm, sampling_rate, audio_block_size)
+    ap = audioProcessing(bpm, t1, block_size=block_size)
+    clicks = getClickPositions(metro, len(s))
+
+    # the nearest click within half a pulse interval
+    delays = []
+    for peak_loc in ap.getSignalPeaks(s):
+        d = peak_loc*ap.N_step - clicks
+        n = numpy.argmin(numpy.abs(d))
+        if abs(d[n]) < metro.pulse_interval/2:
+            delays.append(d[n])
+    return numpy.array(delays, dtype=numpy.float64), len(clicks), ap
+
+# -------------------------------------------------
+# measure the latency
+# -------------------------------------------------
+def measureLatency(s, bpm, t1, seconds, block_size=None):
+    delays, num_clicks, ap = getClickDelays(s, bpm, t1, block_size)
+    if len(delays) == 0:
+        raise ValueError("No clicks detected, check the loopback and level")
+
+    # analysis bias, from a loopback with no delay and no noise
+    bias_delays, _, _ = getClickDelays(simulateLoopback(bpm, seconds, 0.0, noise=0.0), bpm, t1, block_size)
+    bias = numpy.median(bias_delays)
+
+    to_ms = 1000.0/sampling_rate
+    d = delays - bias
+    return {"bpm":            bpm,
+            "sampling_rate":  sampling_rate,
+            "block_size":     ap.block_size,
+            "N_step":         ap.N_step,
+            "num_clicks":     num_clicks,
+            "num_detected":   len(delays),
+            "default_offset": ap.latency_offset,
+            "bias_ms":        bias*to_ms,
+            "latency_ms":     numpy.median(d)*to_ms,
+            "jitter_ms":      {"std": d.std()*to_ms,
+                               "p5":  numpy.percentile(d, 5)*to_ms,
+                               "p95": numpy.percentile(d, 95)*to_ms,
+                               "min": d.min()*to_ms,
+                               "max": d.max()*to_ms},
+            "latency_offset": ap.latency_offset + numpy.median(delays)/ap.N_step}
+
+# -------------------------------------------------
+# save and load the calibration
+# -------------------------------------------------
+def saveCalibration(result, file_name=calibration_file):
+    with open(file_name, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def loadLatencyOffset(block_size, N_step, file_name=calibration_file):
+    # the measured latency_offset, None if there is no calibration
+    # or it was made with other block or hop sizes
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as f:
+        result = json.load(f)
+    if result.get("block_size") != block_size or result.get("N_step") != N_step:
+        return None
+    return result["latency_offset"]
+
+# -------------------------------------------------
+# main function
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the click to detection latency over a loopback.")
+    parser.add_argument("--bpm", type=int, default=90)
+    parser.add_argument("--sens", type=int, default=8, help="sensitivity, 0 to 10")
+    parser.add_argument("--seconds", type=float, default=20, help="length of the recording")
+    parser.add_argument("--block-size", type=int, help="analysis block size (default: audioProcessing's)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--file", help="recording of the metronome started with it (mono, 44.1 kHz)")
+    group.add_argument("--simulate", type=float, metavar="LATENCY_MS",
+                       help="virtual loopback with this latency")
+    parser.add_argument("--jitter", type=float, default=0.0, help="virtual loopback jitter in ms")
+    parser.add_argument("-o", "--output", default=calibration_file, help="calibration file")
+    parser.add_argument("--no-save", action="store_true", help="only print the results")
+    args = parser.parse_args(argv)
+
+    t1 = (10-args.sens+1)/100.0
+    if args.file:
+        wr = wavReader(args.file)
+        if wr.num_channels != 1 or wr.sampling_rate != sampling_rate:
+            parser.error("expected mono audio at %d Hz" % sampling_rate)
+        s = numpy.array(wr.samples)
+        wr.close()
+    elif args.simulate is not None:
+        s = simulateLoopback(args.bpm, args.seconds, args.simulate, args.jitter)
+    else:
+        s = recordLoopback(args.bpm, args.seconds)
+
+    try:
+        result = measureLatency(s, args.bpm, t1, len(s)/float(sampling_rate), args.block_size)
+    except ValueError as e:
+        sys.stderr.write(str(e) + "\n")
+        return 1
+
+    j = result["jitter_ms"]
+    sys.stdout.write("%d of %d clicks detected\n" % (result["num_detected"], result["num_clicks"]))
+    sys.stdout.write("latency %.1f ms, jitter std %.1f ms (p5 %.1f, p95 %.1f, min %.1f, max %.1f)\n" %
+                     (result["latency_ms"], j["std"], j["p5"], j["p95"], j["min"], j["max"]))
+    sys.stdout.write("latency_offset %.2f envelope samples (default %d)\n" %
+                     (result["latency_offset"], result["default_offset"]))
+    if not args.no_save:
+        saveCalibration(result, args.output)
+        sys.stdout.write("saved to %s\n" % args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,9 +7,15 @@ The metronome class provides audio samples for metronome with specified
 BPM (beat per minute) and sampling rate (44.1 kHz in most cases). The 
 method get_samples returns block_size samples each time it is called. 
 
+Each distinct click (tone of pulse_duration+1 samples) is rendered once
+and cached. After the 8-beat count-in the output repeats every 8 beats,
+so the count-in and one cycle are rendered into a loop buffer when the
+metronome is created, and get_samples returns read-only views into it.
+
 """
 
 import math
+import numpy
 
 # -------------------------------------------
 # global parameters
@@ -21,6 +27,22 @@ amp_arr        = [1, 0.5, 1, 0.5, 1, 0.5, 1, 0.5]
 freq_arr_start = [2000, 2000, 2000, 2000, 2000, 2000, 2000, 2000]
 amp_arr_start  = [1, 0, 1, 0, 1, 1, 1, 1]
 
+# rendered clicks, keyed by (freq, amp, pulse_duration, sampling_rate)
+click_cache    = {}
+
+# -------------------------------------------
+# get (cached) click samples
+# -------------------------------------------
+def get_click(freq, amp, sampling_rate):
+    key = (freq, amp, pulse_duration, sampling_rate)
+    if key not in click_cache:
+        click = numpy.zeros(pulse_duration+1, dtype=numpy.int16)
+        for n in range(pulse_duration+1):
+            click[n] = int(amp*math.sin(n/((sampling_rate/freq)/math.pi))*32767)
+        click.flags.writeable = False
+        click_cache[key] = click
+    return click_cache[key]
+
 class metronome:
     def __init__(self, bpm, sampling_rate, block_size):
         # passed in parameters
@@ -31,41 +53,51 @@ class metronome:
         # derived parameters
         self.pulse_interval = int(60*sampling_rate/bpm/2)
         
+        # pre-render the count-in (clicks 1..8 and the silence before
+        # them) followed by one 8-beat cycle, plus one more block from
+        # the start of the cycle so a block never has to wrap around
+        self.loop_start  = 9*self.pulse_interval
+        self.loop_end    = 17*self.pulse_interval
+        self.loop_buffer = self.render_samples(0, self.loop_end + block_size)
+        self.loop_buffer.flags.writeable = False
+        
         # initializing state parameters
-        self.pulse_active = 0
-        self.pulse_sample_cnt = 0
-        self.beat_cnt = 0
         self.rd_ptr = 0
     
-    def get_samples(self):
-        temp = []
-        for m in range(self.block_size):
-            # check for condition if metronome pulse is active
-            if self.rd_ptr >= self.pulse_interval and self.pulse_active == 0:
-                self.pulse_active = 1
-                self.rd_ptr = 0
-                    
-            self.rd_ptr = self.rd_ptr+1
-            if self.pulse_active == 1:
-                # metronome sample is active, prepare audio samples (tone)
-                if self.beat_cnt < 8:
-                    amp = amp_arr_start[self.beat_cnt%8]
-                    freq = freq_arr_start[self.beat_cnt%8]
-                else:
-                    amp = amp_arr[self.beat_cnt%8]
-                    freq = freq_arr[self.beat_cnt%8]
-                    
-                    
-                temp.append(int(amp*math.sin(self.pulse_sample_cnt/((self.sampling_rate/freq)/math.pi))*32767))
-                self.pulse_sample_cnt = self.pulse_sample_cnt + 1
-                if self.pulse_sample_cnt > pulse_duration:
-                    self.pulse_sample_cnt = 0
-                    self.pulse_active = 0
-                    self.beat_cnt = self.beat_cnt + 1
+    def render_samples(self, start, length):
+        temp = numpy.zeros(length, dtype=numpy.int16)
+        
+        # click k (k = 1, 2, ...) starts at sample k*pulse_interval
+        # and plays beat k-1 of the pattern
+        block_start = start
+        block_end   = start + length
+        k_first = max(1, -(-(block_start - pulse_duration)//self.pulse_interval))
+        k_last  = (block_end - 1)//self.pulse_interval
+        
+        for k in range(k_first, k_last+1):
+            beat_cnt = k - 1
+            if beat_cnt < 8:
+                amp = amp_arr_start[beat_cnt%8]
+                freq = freq_arr_start[beat_cnt%8]
             else:
-                # metronome sample is inactive, append zeros
-                temp.append(0)
+                amp = amp_arr[beat_cnt%8]
+                freq = freq_arr[beat_cnt%8]
+            click = get_click(freq, amp, self.sampling_rate)
+            
+            # overlap of the click with this block
+            click_start = k*self.pulse_interval
+            n_0 = max(click_start, block_start)
+            n_1 = min(click_start + len(click), block_end)
+            temp[n_0-block_start:n_1-block_start] = click[n_0-click_start:n_1-click_start]
         
         return temp
+    
+    def get_samples(self):
+        temp = self.loop_buffer[self.rd_ptr:self.rd_ptr+self.block_size]
+        
+        # wrap around to the start of the cycle
+        self.rd_ptr = self.rd_ptr + self.block_size
+        if self.rd_ptr >= self.loop_end:
+            self.rd_ptr = self.rd_ptr - (self.loop_end - self.loop_start)
         
-    
\ No newline at end of file
+        return temp
@@ -0,0 +1,346 @@
+# sessionServer: headless drum beat analyzer for many concurrent
+#                practice sessions, each with its own BPM and sensitivity
+
+# Copyright (c) 2015 Bing Hwa Cheng
+
+"""
+Usage:
+
+    python sessionServer.py --port 5000 --jobs 8
+    python sessionServer.py rec1.wav rec2.wav --bpm 90 --sens 8
+
+The sessionManager class owns any number of independent audioProcessing
+instances (sessions). Each session is assigned to one of a fixed pool of
+worker processes, the one with the fewest sessions, and stays there, so
+its blocks are analyzed in order while the sessions as a whole are spread
+over all cores. PCM samples (int16) pushed for a session are collected
+into blocks of block_size and sent to its worker. A worker input queue
+holds at most max_pending blocks; when it is full a block is dropped and
+counted, in the same way as spscRingBuffer, which keeps the per-block
+latency bounded. The worker is told how many blocks were dropped before
+the next one and skips over them, so peak locations keep their timing.
+Beat info is sent back whenever a block has peaks and delivered to the
+session's callback, or to its queue if it has none.
+
+Samples can come from anything that calls pushSamples: feedWavFile plays
+a wav file (in real time unless told otherwise), feedStream reads raw
+PCM from a file object such as a pipe, and serveSockets accepts TCP
+connections, one session each. A connection starts with a line
+"<bpm> <sens> <level>" followed by raw mono 16 bit 44.1 kHz PCM, and
+receives one line of C/E/L results every time the beat info changes.
+Socket sessions never drop blocks, a full queue stops reading from the
+connection and TCP pushes back on the sender.
+
+"""
+
+import sys
+import time
+import Queue
+import signal
+import threading
+import argparse
+import SocketServer
+import multiprocessing
+import numpy
+from audioProcessing import audioProcessing
+from utility import getBeatResult
+from utility import wavReader
+
+# -------------------------------------------------
+# global parameters
+# -------------------------------------------------
+sampling_rate = 44100
+block_size    = 4096
+sample_size   = 2     # bytes per sample (int16)
+
+# -------------------------------------------------
+# worker process main loop
+# -------------------------------------------------
+def runSessionWorker(in_queue, result_queue):
+    sessions = {}
+
+    # Ctrl-C is handled by the manager, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # all results are flushed before the process exits, the
+    # dispatcher keeps reading them until the workers are stopped
+    while True:
+        msg = in_queue.get()
+        if msg is None:
+            break
+
+        if msg[0] == "block":
+            _, session_id, data, push_time, num_skipped = msg
+            ap = sessions[session_id]
+
+            # dropped blocks before this one
+            peak_found = 0
+            if num_skipped > 0:
+                peak_found = ap.skipBlocks(num_skipped)
+            peak_found = peak_found + ap.audioSampleProcessing(numpy.frombuffer(data, dtype=numpy.int16))
+            if peak_found > 0:
+                result_queue.put(("beat", session_id, list(ap.getBeatLoc()),
+                                  [float(e) for e in ap.getBeatError()], push_time))
+        elif msg[0] == "add":
+            _, session_id, bpm, t1 = msg
+            sessions[session_id] = audioProcessing(bpm, t1)
+        elif msg[0] == "remove":
+            _, session_id = msg
+            del sessions[session_id]
+            result_queue.put(("closed", session_id))
+
+class session:
+    def __init__(self, session_id, bpm, sens, level, worker, callback):
+        self.session_id = session_id
+        self.bpm = bpm
+        self.sens = sens
+        self.level = level
+        self.worker = worker
+        self.callback = callback
+
+        # beat info, (beat_loc, beat_error, result), if there is no callback
+        self.result_queue = Queue.Queue()
+
+        # samples not yet making up a whole block
+        self.pending = bytearray()
+
+        # statistics
+        self.num_blocks = 0
+        self.num_dropped = 0
+        self.max_latency = 0.0
+
+        # blocks dropped since the last one sent
+        self.num_skipped = 0
+
+        # set when the worker has removed the session
+        self.closed = threading.Event()
+
+class sessionManager:
+    def __init__(self, num_workers=multiprocessing.cpu_count(), max_pending=64):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+        # worker processes, each with its own input queue
+        self.result_queue = multiprocessing.Queue()
+        self.in_queues = []
+        self.workers = []
+        self.num_sessions = [0]*num_workers
+        for k in range(num_workers):
+            in_queue = multiprocessing.Queue(max_pending)
+            p = multiprocessing.Process(target=runSessionWorker, args=(in_queue, self.result_queue))
+            p.daemon = True
+            p.start()
+            self.in_queues.append(in_queue)
+            self.workers.append(p)
+
+        # dispatches results to the sessions
+        self.dispatcher = threading.Thread(target=self.dispatchResults)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    # -------------------------------------------
+    # add a session, returns the session id
+    # -------------------------------------------
+    def addSession(self, bpm, sens, level=2, callback=None):
+        # callback(session_id, beat_loc, beat_error, result) is called
+        # from the dispatcher thread, and should return quickly
+        with self.lock:
+            session_id = self.next_id
+            self.next_id = self.next_id + 1
+            worker = self.num_sessions.index(min(self.num_sessions))
+            self.num_sessions[worker] = self.num_sessions[worker] + 1
+            self.sessions[session_id] = session(session_id, bpm, sens, level, worker, callback)
+        self.in_queues[worker].put(("add", session_id, bpm, (10-sens+1)/100.0))
+        return session_id
+
+    # -------------------------------------------
+    # remove a session
+    # -------------------------------------------
+    def removeSession(self, session_id, timeout=None):
+        # waits until all blocks of the session are analyzed,
+        # samples short of a whole block are discarded
+        ses = self.sessions[session_id]
+        self.in_queues[ses.worker].put(("remove", session_id))
+        ses.closed.wait(timeout)
+        with self.lock:
+            del self.sessions[session_id]
+            self.num_sessions[ses.worker] = self.num_sessions[ses.worker] - 1
+        return ses
+
+    # -------------------------------------------
+    # get the queue with the session's beat info
+    # -------------------------------------------
+    def getResultQueue(self, session_id):
+        return self.sessions[session_id].result_queue
+
+    # -------------------------------------------
+    # pass samples (int16 array or raw bytes) to a session
+    # -------------------------------------------
+    def pushSamples(self, session_id, s, wait=False):
+        # any number of samples can be passed, with wait=False a block
+        # is dropped if the worker is too far behind
+        ses = self.sessions[session_id]
+        if isinstance(s, numpy.ndarray):
+            s = s.astype(numpy.int16, copy=False).tostring()
+        ses.pending.extend(s)
+
+        num_bytes = block_size*sample_size
+        while len(ses.pending) >= num_bytes:
+            data = bytes(ses.pending[:num_bytes])
+            del ses.pending[:num_bytes]
+            try:
+                self.in_queues[ses.worker].put(("block", session_id, data, time.time(), ses.num_skipped), wait)
+                ses.num_blocks = ses.num_blocks + 1
+                ses.num_skipped = 0
+            except Queue.Full:
+                ses.num_dropped = ses.num_dropped + 1
+                ses.num_skipped = ses.num_skipped + 1
+
+    # -------------------------------------------
+    # deliver results from the workers (dispatcher thread)
+    # -------------------------------------------
+    def dispatchResults(self):
+        while True:
+            msg = self.result_queue.get()
+            if msg is None:
+                break
+
+            ses = self.sessions.get(msg[1])
+            if ses is None:
+                continue
+            if msg[0] == "closed":
+                ses.closed.set()
+                continue
+
+            _, session_id, beat_loc, beat_error, push_time = msg
+            ses.max_latency = max(ses.max_latency, time.time() - push_time)
+            result = getBeatResult(beat_loc, beat_error, ses.level)
+            if ses.callback is not None:
+                ses.callback(session_id, beat_loc, beat_error, result)
+            else:
+                ses.result_queue.put((beat_loc, beat_error, result))
+
+    # -------------------------------------------
+    # stop the worker processes
+    # -------------------------------------------
+    def stop(self):
+        for in_queue in self.in_queues:
+            in_queue.put(None)
+        for p in self.workers:
+            p.join()
+        self.result_queue.put(None)
+        self.dispatcher.join()
+
+# -------------------------------------------------
+# sample sources
+# -------------------------------------------------
+def feedWavFile(manager, session_id, file_name, realtime=True):
+    # plays a wav file into a session, paced like a live
+    # device unless realtime is False
+    wr = wavReader(file_name)
+    start_time = time.time()
+    num_samples = 0
+    for s in wr.getBlocks(block_size):
+        manager.pushSamples(session_id, s, not realtime)
+        num_samples = num_samples + len(s)
+        if realtime:
+            time.sleep(max(0, start_time + num_samples/float(sampling_rate) - time.time()))
+    wr.close()
+
+def feedStream(manager, session_id, f, wait=True):
+    # reads raw PCM from a file object (a pipe, a fifo, stdin, ...)
+    # until end of file
+    while True:
+        data = f.read(block_size*sample_size)
+        if not data:
+            break
+        manager.pushSamples(session_id, data, wait)
+
+class sessionRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        manager = self.server.manager
+        try:
+            bpm, sens, level = [int(x) for x in self.rfile.readline().split()]
+        except ValueError:
+            self.wfile.write("error: expected \"<bpm> <sens> <level>\"\n")
+            return
+
+        # results are written back as they arrive
+        def sendResult(session_id, beat_loc, beat_error, result):
+            try:
+                self.wfile.write(result + "\n")
+                self.wfile.flush()
+            except IOError:
+                pass
+
+        # the PCM is read through rfile too, it may already hold samples
+        # that came in with the header
+        session_id = manager.addSession(bpm, sens, level, sendResult)
+        while True:
+            data = self.rfile.read(block_size*sample_size)
+            if not data:
+                break
+            manager.pushSamples(session_id, data, True)
+        manager.removeSession(session_id)
+
+class sessionTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serveSockets(manager, host, port):
+    server = sessionTCPServer((host, port), sessionRequestHandler)
+    server.manager = manager
+    server.serve_forever()
+
+# -------------------------------------------------
+# main function
+# -------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze many drum practice sessions at once.")
+    parser.add_argument("paths", nargs="*", help="wav files, one session each")
+    parser.add_argument("--bpm", type=int, default=90)
+    parser.add_argument("--sens", type=int, default=8, help="sensitivity, 0 to 10")
+    parser.add_argument("--level", type=int, default=2, help="1=expert, 2=normal, 3=easy")
+    parser.add_argument("--fast", action="store_true",
+                        help="feed the wav files as fast as possible instead of in real time")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="accept sessions on this TCP port")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    if args.port is None and len(args.paths) == 0:
+        parser.error("wav files or --port required")
+
+    manager = sessionManager(args.jobs)
+    if args.port is not None:
+        try:
+            serveSockets(manager, args.host, args.port)
+        except KeyboardInterrupt:
+            pass
+        manager.stop()
+        return 0
+
+    # one session and one feeding thread per wav file
+    def printResult(session_id, beat_loc, beat_error, result):
+        sys.stdout.write("%s: %s\n" % (args.paths[session_id], result))
+
+    threads = []
+    for file_name in args.paths:
+        session_id = manager.addSession(args.bpm, args.sens, args.level, printResult)
+        t = threading.Thread(target=feedWavFile, args=(manager, session_id, file_name, not args.fast))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+    for session_id in range(len(args.paths)):
+        ses = manager.removeSession(session_id)
+        sys.stderr.write("%s: %d blocks, %d dropped, max latency %.1f ms\n" %
+                         (args.paths[session_id], ses.num_blocks, ses.num_dropped, ses.max_latency*1000))
+    manager.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
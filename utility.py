@@ -3,11 +3,15 @@
 # Copyright (c) 2015 Bing Hwa Cheng
 
 import numpy
-import wave
 import struct
-import pyaudio
 import sys
 import math
+import time
+import threading
+import collections
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
 
 # global parameters
 string_beat_1 = ["        ", "_       ", "  _     ", "___     ", "    _   ", "_____   ", "  ___   ", "_____   ", 
@@ -26,12 +30,7 @@ string_beat_3 = ["        ", "o       ", "  o     ", "o o     ", "    o   ", "o
 def printScore(beat_loc, beat_error, level): 
 
     # level vs error threshold
-    if level == 1: 
-        error_thres = 0.10 # expert
-    elif level == 2:
-        error_thres = 0.15 # normal
-    else:
-        error_thres = 0.20 # easy
+    error_thres = getErrorThreshold(level)
     
     # beginning
     string_print_0 = "  "
@@ -79,14 +78,45 @@ def printScore(beat_loc, beat_error, level):
     string_print_3 += " |"
     string_print_4 += "  "
     
-    print string_print_0
-    print string_print_1
-    print string_print_2
-    print string_print_3
-    print string_print_4
+    print(string_print_0)
+    print(string_print_1)
+    print(string_print_2)
+    print(string_print_3)
+    print(string_print_4)
     
     return [string_print_0+"\n"+string_print_1+"\n"+string_print_2+"\n"+string_print_3, string_print_4]
 
+# -------------------------------------------
+# get error threshold of a level
+# -------------------------------------------
+def getErrorThreshold(level):
+    if level == 1: 
+        return 0.10 # expert
+    elif level == 2:
+        return 0.15 # normal
+    else:
+        return 0.20 # easy
+
+# -------------------------------------------
+# get timing result (C=correct, E=early, L=late)
+# -------------------------------------------
+def getBeatResult(beat_loc, beat_error, level):
+    error_thres = getErrorThreshold(level)
+    
+    result = ""
+    for n in range(len(beat_loc)):
+        if beat_loc[n] != 1:
+            result += " "
+        elif beat_error[n] > -error_thres and beat_error[n] < error_thres:
+            result += "C"
+        elif beat_error[n] < -error_thres:
+            result += "E"
+        elif beat_error[n] > error_thres:
+            result += "L"
+        else:
+            result += " "
+    return result
+
 # -------------------------------------------
 # get default (empty) score
 # -------------------------------------------
@@ -122,63 +152,442 @@ def getDefaultScore():
     
     return [string_print_0+"\n"+string_print_1+"\n"+string_print_2+"\n"+string_print_3, string_print_4]
 
+# -------------------------------------------
+# single-producer/single-consumer sample ring
+# -------------------------------------------
+class spscRingBuffer:
+    """
+    Ring of num_blocks blocks of block_size int16 samples between one
+    producer thread (write) and one consumer thread (getBlock and
+    releaseBlock). Each side only advances its own counter, so no lock
+    is taken on the data path. getBlock returns a view into the ring,
+    which stays valid until releaseBlock. A write that does not fit is
+    dropped and counted in num_overruns.
+    
+    With shared=True the samples and counters live in shared memory and
+    the producer and consumer may be in different processes (pass the
+    ring to the child process when it is created).
+    """
+    def __init__(self, num_blocks, block_size, shared=False):
+        self.block_size   = block_size
+        self.length       = num_blocks*block_size
+        self.num_overruns = 0
+        if shared:
+            self.raw_data   = multiprocessing.sharedctypes.RawArray('h', self.length)
+            self.raw_cnt    = multiprocessing.sharedctypes.RawArray(ctypes.c_int64, 2)
+            self.data_ready = multiprocessing.Event()
+        else:
+            self.raw_data   = None
+            self.raw_cnt    = None
+            self.data_ready = threading.Event()
+        self.initArrays()
+    
+    def initArrays(self):
+        # cnt[0]: samples written, producer only
+        # cnt[1]: samples released, consumer only
+        if self.raw_data is not None:
+            self.data = numpy.frombuffer(self.raw_data, dtype=numpy.int16)
+            self.cnt  = numpy.frombuffer(self.raw_cnt, dtype=numpy.int64)
+        else:
+            self.data = numpy.zeros(self.length, dtype=numpy.int16)
+            self.cnt  = numpy.zeros(2, dtype=numpy.int64)
+    
+    def __getstate__(self):
+        # shared arrays are passed on as such, the views are rebuilt
+        state = self.__dict__.copy()
+        del state['data'], state['cnt']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.initArrays()
+    
+    def getFillLevel(self):
+        return int(self.cnt[0] - self.cnt[1])
+    
+    def write(self, s):
+        n = len(s)
+        if self.length - self.getFillLevel() < n:
+            self.num_overruns = self.num_overruns + 1
+            return False
+        
+        wr_pos = self.cnt[0] % self.length
+        n_1 = min(n, self.length - wr_pos)
+        self.data[wr_pos:wr_pos+n_1] = s[:n_1]
+        self.data[:n-n_1] = s[n_1:]
+        self.cnt[0] = self.cnt[0] + n
+        
+        if self.getFillLevel() >= self.block_size:
+            self.data_ready.set()
+        return True
+    
+    def getBlock(self, timeout):
+        # wait (up to timeout seconds) for a complete block,
+        # returns None on timeout
+        if self.getFillLevel() < self.block_size:
+            self.data_ready.clear()
+            # check again, the producer may have written before clear
+            if self.getFillLevel() < self.block_size:
+                self.data_ready.wait(timeout)
+            if self.getFillLevel() < self.block_size:
+                return None
+        
+        rd_pos = self.cnt[1] % self.length
+        return self.data[rd_pos:rd_pos+self.block_size]
+    
+    def releaseBlock(self):
+        self.cnt[1] = self.cnt[1] + self.block_size
+
+# -------------------------------------------
+# streaming wav file writer
+# -------------------------------------------
+class wavWriter:
+    """
+    Writes mono PCM blocks to a wav file as they come in. The RIFF and
+    data chunk sizes are written as 0 on open and patched on close; a
+    file left unclosed (e.g. after a crash) still holds all blocks
+    written so far, and wavReader reads it to the end of file. Once
+    max_samples (if set) are written, further blocks are dropped and
+    counted in num_dropped.
+    """
+    def __init__(self, max_samples=None):
+        self.f = None
+        self.max_samples = max_samples
+    
+    def open(self, file_name, samp_width, sampling_rate):
+        self.f = open(file_name, 'wb')
+        self.samp_width = samp_width
+        self.num_bytes = 0
+        self.num_dropped = 0
+        self.f.write(struct.pack('<4sI4s4sIHHIIHH4sI',
+                                 b'RIFF', 0, b'WAVE',
+                                 b'fmt ', 16, 1, 1, sampling_rate,
+                                 sampling_rate*samp_width, samp_width, 8*samp_width,
+                                 b'data', 0))
+    
+    def append_block(self, s):
+        if self.max_samples is not None and self.num_bytes//self.samp_width + len(s) > self.max_samples:
+            self.num_dropped = self.num_dropped + len(s)
+            return False
+        
+        # written straight from the array buffer
+        s = numpy.asarray(s, dtype='<i%d' % self.samp_width)
+        s.tofile(self.f)
+        self.num_bytes = self.num_bytes + s.nbytes
+        return True
+    
+    def close(self):
+        # odd length data chunk is padded to an even size
+        if self.num_bytes % 2 == 1:
+            self.f.write(b'\x00')
+        self.f.seek(4)
+        self.f.write(struct.pack('<I', 36 + self.num_bytes + self.num_bytes%2))
+        self.f.seek(40)
+        self.f.write(struct.pack('<I', self.num_bytes))
+        self.f.close()
+        self.f = None
+
 # -------------------------------------------
 # save the recording into wav file
 # -------------------------------------------
 def saveWavFile(samp_width, sampling_rate, decoded):
-    wf = wave.open("drum_beat_recording.wav", 'wb')
-    wf.setnchannels(1)
-    wf.setsampwidth(samp_width)
-    wf.setframerate(sampling_rate)
-    temp_out = ''.join(struct.pack('h', samp) for samp in decoded)
-    wf.writeframes(temp_out)
-    wf.close()
+    ww = wavWriter()
+    ww.open("drum_beat_recording.wav", samp_width, sampling_rate)
+    ww.append_block(decoded)
+    ww.close()
+    
+# -------------------------------------------
+# memory-mapped wav file reader
+# -------------------------------------------
+class wavReader:
+    """
+    Maps the data chunk of a 16 bit PCM wav file into memory. samples is
+    a read-only int16 view of the file (num_frames x num_channels if not
+    mono), nothing is read until it is accessed. A data chunk size left
+    at 0 or beyond the end of file (recording not closed) is taken as
+    the rest of the file.
+    """
+    def __init__(self, file_name):
+        f = open(file_name, 'rb')
+        try:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+                raise ValueError("Not a wav file: " + file_name)
+            
+            # walk the chunks up to the data chunk
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError("No data chunk: " + file_name)
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt_data = f.read(16)
+                    if chunk_size < 16 or len(fmt_data) < 16:
+                        raise ValueError("Bad fmt chunk: " + file_name)
+                    fmt = struct.unpack('<HHIIHH', fmt_data)
+                    f.seek(chunk_size - 16 + chunk_size%2, 1)
+                elif chunk_id == b'data':
+                    data_offset = f.tell()
+                    break
+                else:
+                    f.seek(chunk_size + chunk_size%2, 1)
+            
+            f.seek(0, 2)
+            file_size = f.tell()
+        finally:
+            f.close()
+        
+        if fmt is None:
+            raise ValueError("No fmt chunk: " + file_name)
+        format_tag, self.num_channels, self.sampling_rate, byte_rate, block_align, bits = fmt
+        if format_tag not in (1, 0xFFFE) or bits != 16:
+            raise ValueError("Not 16 bit PCM: " + file_name)
+        if self.num_channels == 0 or block_align == 0:
+            raise ValueError("Bad fmt chunk: " + file_name)
+        
+        if chunk_size == 0 or data_offset + chunk_size > file_size:
+            chunk_size = file_size - data_offset
+        self.num_frames = chunk_size//block_align
+        
+        if self.num_frames > 0:
+            self.samples = numpy.memmap(file_name, dtype='<i2', mode='r', offset=data_offset,
+                                        shape=(self.num_frames*self.num_channels,))
+        else:
+            self.samples = numpy.zeros(0, dtype='<i2')
+        if self.num_channels > 1:
+            self.samples = self.samples.reshape(self.num_frames, self.num_channels)
+    
+    def getBlocks(self, block_size):
+        for n in range(0, self.num_frames, block_size):
+            yield self.samples[n:n+block_size]
     
+    def close(self):
+        self.samples = None
+
 # -------------------------------------------
 # play the recorded wav file
 # -------------------------------------------
 def playWavFile(sampling_rate, block_size):
-    wf = wave.open("drum_beat_recording.wav", 'rb')
+    # imported here so the analysis code runs without PortAudio
+    import pyaudio
+    
+    wr = wavReader("drum_beat_recording.wav")
     p = pyaudio.PyAudio()
     stream = p.open(format=pyaudio.paInt16,
                     channels=1,
                     rate=sampling_rate,
                     output=True)
 
-    data = wf.readframes(block_size)
-
-    while data != '':
-        stream.write(data)
-        data = wf.readframes(block_size)
+    # blocks are views into the mapped file
+    for data in wr.getBlocks(block_size):
+        stream.write(data, len(data))
+    wr.close()
 
     stream.stop_stream()
     stream.close()
 
     p.terminate()
     
+# -------------------------------------------
+# ring buffer with contiguous read window
+# -------------------------------------------
+class ringBuffer:
+    """
+    Preallocated ring buffer of the last `length` samples. Every sample is
+    stored twice (at n and n+length), so the whole history is always one
+    contiguous view, oldest sample first, with no shifting on write.
+    """
+    def __init__(self, length, dtype=numpy.float64):
+        self.length = length
+        self.data   = numpy.zeros(2*length, dtype)
+        self.wr_ptr = 0
+    
+    def write(self, s, scale=1):
+        L = self.length
+        n = len(s)
+        n_1 = min(n, L - self.wr_ptr)
+        
+        # write (and scale) in place, wrapping at the end of the buffer
+        numpy.multiply(s[:n_1], scale, out=self.data[self.wr_ptr:self.wr_ptr+n_1])
+        numpy.multiply(s[n_1:], scale, out=self.data[:n-n_1])
+        
+        # mirror copy
+        self.data[L+self.wr_ptr:L+self.wr_ptr+n_1] = self.data[self.wr_ptr:self.wr_ptr+n_1]
+        self.data[L:L+n-n_1] = self.data[:n-n_1]
+        
+        self.wr_ptr = (self.wr_ptr + n) % L
+    
+    def getWindow(self):
+        return self.data[self.wr_ptr:self.wr_ptr+self.length]
+
+# -------------------------------------------
+# performance counters
+# -------------------------------------------
+class perfCounters:
+    """
+    Named counters, gauges and timers for profiling a live session.
+    count() adds to a counter, setValue() sets a gauge (its maximum is
+    kept as well) and addTime() adds a duration in seconds to a timer,
+    which keeps the number of calls, the total and the maximum, and with
+    keep_times every duration (getTimes). Nothing is collected unless a
+    perfCounters object is passed in.
+    """
+    timer = staticmethod(getattr(time, 'perf_counter', time.time))
+    
+    def __init__(self, keep_times=False):
+        self.lock = threading.Lock()
+        self.keep_times = keep_times
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.values   = {}
+            self.timers   = {}
+            self.times    = {}
+            self.start_time = self.timer()
+    
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def setValue(self, name, value):
+        with self.lock:
+            value_max = max(value, self.values.get(name, (value, value))[1])
+            self.values[name] = (value, value_max)
+    
+    def addTime(self, name, t):
+        with self.lock:
+            num_calls, t_total, t_max = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = (num_calls + 1, t_total + t, max(t_max, t))
+            if self.keep_times:
+                self.times.setdefault(name, []).append(t)
+    
+    def getTimes(self, name):
+        # every duration of a timer (keep_times only)
+        with self.lock:
+            return list(self.times.get(name, []))
+    
+    def getSnapshot(self):
+        # times in ms
+        with self.lock:
+            snapshot = {"elapsed_s": self.timer() - self.start_time}
+            snapshot.update(self.counters)
+            for name, (value, value_max) in self.values.items():
+                snapshot[name] = value
+                snapshot[name + "_max"] = value_max
+            for name, (num_calls, t_total, t_max) in self.timers.items():
+                snapshot[name + "_calls"]   = num_calls
+                snapshot[name + "_mean_ms"] = t_total/num_calls*1e3
+                snapshot[name + "_max_ms"]  = t_max*1e3
+        return snapshot
+    
+    def getLogLine(self):
+        snapshot = self.getSnapshot()
+        items = []
+        for name in sorted(snapshot):
+            if isinstance(snapshot[name], float):
+                items.append("%s=%.3f" % (name, snapshot[name]))
+            else:
+                items.append("%s=%d" % (name, snapshot[name]))
+        return " ".join(items)
+
+# -------------------------------------------
+# time a method of one object
+# -------------------------------------------
+def timeMethod(obj, name, perf):
+    # the timed version is set on obj itself, the class and
+    # other instances are not changed
+    method = getattr(obj, name)
+    def timedMethod(*args):
+        t0 = perf.timer()
+        result = method(*args)
+        perf.addTime(name, perf.timer() - t0)
+        return result
+    setattr(obj, name, timedMethod)
+
+# -------------------------------------------
+# bounded cache of read-only coefficient arrays
+# -------------------------------------------
+class coefficientCache:
+    """
+    Keeps the arrays (or other objects) computed by compute(*key) for
+    the max_size most recently used keys. Every caller of get gets the
+    same one, so arrays are made read-only; copy one before modifying
+    it.
+    """
+    def __init__(self, compute, max_size=32):
+        self.compute  = compute
+        self.max_size = max_size
+        self.arrays   = collections.OrderedDict()
+        self.lock     = threading.Lock()
+        
+    def get(self, *key):
+        with self.lock:
+            a = self.arrays.pop(key, None)
+            if a is None:
+                a = self.compute(*key)
+                if isinstance(a, numpy.ndarray):
+                    a.flags.writeable = False
+            self.arrays[key] = a
+            if len(self.arrays) > self.max_size:
+                self.arrays.popitem(last=False)
+            return a
+
 # -------------------------------------------
 # compute Hamming window
 # -------------------------------------------
+def computeHammingWindow(length):
+    return 0.54 - 0.46*numpy.cos(2*math.pi*numpy.arange(length)/length)
+
+hamming_windows = coefficientCache(computeHammingWindow)
+
 def getHammingWindow(length):
-    w = []
-    for n in range(length):
-        w.append( 0.54 - 0.46*math.cos(2*math.pi*n/length) )
-    return w
+    # shared read-only array
+    return hamming_windows.get(length)
 
 # -------------------------------------------
 # compute low pass filter
 # -------------------------------------------
-def getLowPassFilter(fc, Fs, N):
+def computeLowPassFilter(fc, Fs, N):
     w = getHammingWindow(N)
     wc = 2*math.pi*fc/Fs
-    h = []
-    for n in range(N):
-        if n == N/2:
-            h.append( wc/math.pi )
-        else:
-            h.append( math.sin(wc*(n-N/2))/(math.pi*(n-N/2))*w[n] )
+    n = numpy.arange(N) - N//2
+    h = numpy.empty(N)
+    k = n != 0
+    h[k] = numpy.sin(wc*n[k])/(math.pi*n[k])*w[k]
+    h[N//2] = wc/math.pi
     return h
 
+low_pass_filters = coefficientCache(computeLowPassFilter)
+
+def getLowPassFilter(fc, Fs, N):
+    # shared read-only array
+    return low_pass_filters.get(fc, Fs, N)
+
+# -------------------------------------------
+# block FIR filtering with state
+# -------------------------------------------
+def firFilter(h, x, state):
+    # state holds the last len(h)-1 inputs of the previous block
+    # (oldest first), the returned state continues the stream
+    x_ext = numpy.concatenate((state, x))
+    y = numpy.convolve(x_ext, h, 'valid')
+    return y, x_ext[len(x_ext)-len(h)+1:]
+
+# -------------------------------------------
+# compute windowed DFT matrix for low freq bins
+# -------------------------------------------
+def getLowBandDFTMatrix(w, N_bin):
+    # columns 0..N_bin-1 give the real part and columns
+    # N_bin..2*N_bin-1 the imaginary part of bins 0..N_bin-1
+    # of the length len(w) DFT of the windowed frame
+    N = len(w)
+    phase = 2*numpy.pi*numpy.outer(numpy.arange(N), numpy.arange(N_bin))/N
+    w_col = numpy.asarray(w, dtype=numpy.float64)[:, numpy.newaxis]
+    return numpy.hstack((w_col*numpy.cos(phase), -w_col*numpy.sin(phase)))
+
 
 
 